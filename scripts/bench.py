@@ -0,0 +1,223 @@
+'''
+Scaling benchmark of the network building stages on synthetic corpora (synth.py).
+
+For every corpus size the stages run one after the other, each in a fresh (spawned)
+process that reads the outputs of the previous stage from workdir/<size>/, so the wall
+time and the peak resident memory (ru_maxrss) of one stage are not mixed with those of
+the others. Imports and loading the inputs are not timed; baseline_rss_mb is the peak
+memory before the timed call, which includes the loaded inputs. Results are written as
+json: one record per (size, stage) and, per stage, the exponent b of a power law fit
+seconds ~ size^b, to compare runs with --compare.
+
+usage: python bench.py --sizes 10000 100000 1000000 --out output/bench.json
+'''
+from pathlib import Path
+import argparse
+import glob
+import json
+import multiprocessing
+import pickle
+import platform
+import sys
+import time
+import numpy as np
+
+
+def _load(fp):
+    with open(fp, 'rb') as f:
+        return pickle.load(f)
+
+
+def _dump(obj, fp):
+    with open(fp, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+
+# every stage loads its inputs and returns (the timed call, file to pickle its result to or None)
+def stage_parse(d, opts):
+    from parse import parse_files
+    matches = sorted(glob.glob(str(d / 'data' / '*_data_*.json')))
+    return lambda: parse_files(matches, workers=opts['workers']), d / 'parsed.pkl'
+
+
+def stage_format(d, opts):
+    from build_net import format_tweets
+    parsed = _load(d / 'parsed.pkl')
+    return lambda: format_tweets(parsed['original_tweets'], parsed['retweets'], v=False), d / 'frames.pkl'
+
+
+def stage_rt_join(d, opts):
+    from build_net import rt_source_to_target
+    tweetsdf, retweetsdf = _load(d / 'frames.pkl')
+    return lambda: rt_source_to_target(tweetsdf, retweetsdf, method=opts['rt_method'])[0], d / 'rt_connections.pkl'
+
+
+def stage_rt_edgelist(d, opts):
+    from build_net import write_edgelist
+    connectionlist = _load(d / 'rt_connections.pkl')
+    return lambda: write_edgelist(connectionlist, d / 'rt_edgelist.txt', v=False), None
+
+
+def stage_ht_edges(d, opts):
+    from build_net import process_hashtags, ht_source_to_target
+    tweetsdf, _ = _load(d / 'frames.pkl')
+    return lambda: ht_source_to_target(process_hashtags(tweetsdf, v=False)[0], method=opts['ht_method']), d / 'ht_connections.pkl'
+
+
+def stage_ht_edgelist(d, opts):
+    from build_net import write_edgelist
+    connectionlist = _load(d / 'ht_connections.pkl')
+    return lambda: write_edgelist(connectionlist, d / 'ht_edgelist.txt', v=False), None
+
+
+def _network_stats(graphs, path_sources, workers):
+    from paths import path_stats
+    out = {}
+    for name, g in graphs.items():
+        out[name] = dict(strengths=g.strengths(), weights=g.weights(), clustering=g.clustering())
+        if path_sources:
+            out[name]['paths'] = path_stats(g.adjacency, n_sources=path_sources, workers=workers, seed=0)
+    return out
+
+
+def stage_stats(d, opts):
+    # the statistics of vis.vis_net_stats, without the figures (their drawing time does not scale with the networks)
+    from csrgraph import CSRGraph
+    graphs = dict(rt=CSRGraph.read(d / 'rt_edgelist.txt').largest_component(), ht=CSRGraph.read(d / 'ht_edgelist.txt').largest_component())
+    return lambda: _network_stats(graphs, opts['path_sources'], opts['workers']), None
+
+
+STAGES = {
+    'parse': stage_parse,
+    'format': stage_format,
+    'rt_join': stage_rt_join,
+    'rt_edgelist': stage_rt_edgelist,
+    'ht_edges': stage_ht_edges,
+    'ht_edgelist': stage_ht_edgelist,
+    'stats': stage_stats,
+}
+
+
+
+def _measure(name, d, opts, queue):
+    '''Run one stage in this (child) process and report its wall time and peak memory.'''
+    import matplotlib
+    matplotlib.use('Agg')
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from instrument import configure, stage, records, peak_rss_mb
+    configure(stage_peaks=True)
+    call, outfp = STAGES[name](d, opts)
+    baseline = peak_rss_mb()
+    with stage('bench_' + name):
+        t = time.perf_counter()
+        result = call()
+        seconds = time.perf_counter() - t
+    # with stage peaks staged functions reset the high-water mark (and ru_maxrss with it), the enclosing stage keeps their peaks
+    peak = records('bench_' + name)[-1]['peak_rss_mb']
+    queue.put(dict(seconds=seconds, peak_rss_mb=peak if peak is not None else peak_rss_mb(), baseline_rss_mb=baseline))
+    if outfp:
+        _dump(result, outfp)
+
+
+
+def run_stage(name, d, opts):
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    p = ctx.Process(target=_measure, args=(name, d, opts, queue))
+    p.start()
+    p.join()
+    if p.exitcode != 0:
+        raise RuntimeError('Stage {} failed with exit code {}.'. format(name, p.exitcode))
+    return queue.get()
+
+
+
+def scaling_exponents(results):
+    '''Per stage exponent b of seconds ~ size^b (least squares in log-log), None with fewer than two sizes.'''
+    exponents = {}
+    for name in STAGES:
+        r = [(x['size'], x['seconds']) for x in results if x['stage'] == name and x['seconds'] > 0]
+        if len(set(s for s, _ in r)) < 2:
+            exponents[name] = None
+            continue
+        sizes, seconds = np.log(np.array(r)).T
+        exponents[name] = float(np.polyfit(sizes, seconds, 1)[0])
+    return exponents
+
+
+
+def benchmark(sizes, workdir, stages=None, workers=None, rt_method='index', ht_method='sparse', path_sources=100, seed=0, v=False):
+    '''
+    Generate a corpus of every size (reused if present in workdir) and time the stages on it.
+
+    Returns:
+    -------
+    dict with meta (versions, options), results (list of records size, stage, seconds,
+        peak_rss_mb, baseline_rss_mb) and scaling (stage -> exponent)
+    '''
+    from synth import generate
+    import pandas as pd
+    import scipy
+
+    stages = stages or list(STAGES)
+    opts = dict(workers=workers, rt_method=rt_method, ht_method=ht_method, path_sources=path_sources)
+    results = []
+    for size in sizes:
+        d = Path(workdir) / str(size)
+        if not glob.glob(str(d / 'data' / '*_data_*.json')):
+            v and print('Generating {} tweets in {}'. format(size, d))
+            generate(size, d / 'data', n_files=max(1, min(100, size // 100000)), seed=seed)
+        for name in stages:
+            r = dict(size=size, stage=name, **run_stage(name, d, opts))
+            results.append(r)
+            v and print('{:>10} {:<12} {:9.3f}s {:9.1f}MB'. format(size, name, r['seconds'], r['peak_rss_mb']))
+
+    return dict(
+            meta=dict(python=platform.python_version(), numpy=np.__version__, pandas=pd.__version__, scipy=scipy.__version__,
+                machine=platform.machine(), cpus=multiprocessing.cpu_count(), time=time.strftime('%Y-%m-%dT%H:%M:%S'), **opts),
+            results=results,
+            scaling=scaling_exponents(results))
+
+
+
+def compare(old, new):
+    '''Print the time and memory ratio new / old of every (size, stage) measured in both runs.'''
+    old = {(r['size'], r['stage']): r for r in old['results']}
+    print('{:>10} {:<12} {:>8} {:>8}'. format('size', 'stage', 'time', 'memory'))
+    for r in new['results']:
+        o = old.get((r['size'], r['stage']))
+        if o:
+            print('{:>10} {:<12} {:8.2f} {:8.2f}'. format(r['size'], r['stage'], r['seconds'] / o['seconds'], r['peak_rss_mb'] / o['peak_rss_mb']))
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time and memory-profile the network building stages on synthetic corpora.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7])
+    parser.add_argument('--workdir', default='data/bench/', help='generated corpora and intermediate outputs')
+    parser.add_argument('--out', default='output/bench.json')
+    parser.add_argument('--stages', nargs='*', choices=list(STAGES), help='stages to time, all by default')
+    parser.add_argument('--workers', type=int, default=None, help='processes for parsing')
+    parser.add_argument('--rt-method', default='index', choices=('index', 'scan'))
+    parser.add_argument('--ht-method', default='sparse', choices=('sparse', 'combinations'))
+    parser.add_argument('--path-sources', type=int, default=100, help='sampled sources for path statistics, 0 to skip them')
+    parser.add_argument('--compare', default=None, help='earlier results json to compare with')
+    parser.add_argument('-v', action='store_true')
+    args = parser.parse_args(argv)
+
+    report = benchmark(args.sizes, args.workdir, stages=args.stages, workers=args.workers, rt_method=args.rt_method,
+            ht_method=args.ht_method, path_sources=args.path_sources, v=args.v)
+    Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=1)
+    args.v and print('Scaling exponents: {}'. format(report['scaling']))
+    args.v and print('Results written to {}'. format(args.out))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+
+if __name__ == '__main__':
+    main()
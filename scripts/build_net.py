@@ -1,46 +1,64 @@
 from time import time
-from collections import Counter
 from datetime import timedelta
 import json
 import pandas as pd
 import numpy as np
+from scipy import sparse
 import matplotlib.pyplot as plt
 import itertools as it
+from instrument import staged, gauge, progress
+from columnar import TweetTable
+from tagstats import TagStats
 
 
 
-def format_tweets(tweets, retweets, ref_col='referenced_tweet_id', v=True, vv=False):
+@staged
+def format_tweets(tweets, retweets, ref_col='referenced_tweet_id', table=False, v=True, vv=False):
     '''
     Check data and format as dataframes.
     Takes a list of tweet objects and a list of retweet objects and returns them as dataframes.
     Prints some summary statistics.
+    table: return columnar.TweetTable instead of data frames, ids as int64 and tags and
+        referenced ids as flat arrays with offsets (a fraction of the memory of the object
+        columns). rt_source_to_target and process_hashtags take either, TweetTable.to_frame
+        gives the data frames. tweets and retweets can also be TweetTables already.
     '''
 
-    tweetsdf = pd.DataFrame(tweets)
-    retweetsdf = pd.DataFrame(retweets)
-    v and print('Tweets formatted as dataframes. There are {} tweets and {} retweets.'. format(len(tweetsdf), len(retweetsdf)))
+    if table:
+        tweetsdf = tweets if isinstance(tweets, TweetTable) else TweetTable.from_records(tweets)
+        retweetsdf = retweets if isinstance(retweets, TweetTable) else TweetTable.from_records(retweets)
+        ref_lengths = retweetsdf.ref_lengths(ref_col)
+    else:
+        tweetsdf = tweets.to_frame() if isinstance(tweets, TweetTable) else pd.DataFrame(tweets)
+        retweetsdf = retweets.to_frame() if isinstance(retweets, TweetTable) else pd.DataFrame(retweets)
+        ref_lengths = retweetsdf[ref_col].str.len().values
+    v and print('Tweets formatted as {}. There are {} tweets and {} retweets.'. format('tables' if table else 'dataframes', len(tweetsdf), len(retweetsdf)))
 
     # are all the original tweet references in the retweet dataset of length 1?
-    lengths = np.unique([len(re) for re in retweetsdf[ref_col]])
+    lengths = np.unique(ref_lengths)
     v and print('Unique lengths of referenced tweet column entries: {}'. format(lengths))
         
     # check multi-referencing tweets
     # multi-references means that a tweet references more than one original retweet, quote, reply
     # at the same time.
-    multi_ref_count = 0
+    multi_refs = np.flatnonzero(ref_lengths > 1)
+    multi_ref_count = len(multi_refs)
 
-    for i, re_id in enumerate(retweetsdf[ref_col]):
-        if len(re_id) > 1:
-            entry = retweetsdf.iloc[i]
-            multi_ref_count += 1
-            vv and print('\n {} \n full ref data: {}\n'. format(entry, entry.full_ref_data))
+    if vv:
+        entries = retweetsdf.take(multi_refs).to_frame() if table else retweetsdf.iloc[multi_refs]
+        for _, entry in entries.iterrows():
+            print('\n {} \n full ref data: {}\n'. format(entry, entry.full_ref_data))
     v and print('Number of multi-referencing entries: {}'. format(multi_ref_count))
+    gauge('tweets', len(tweetsdf))
+    gauge('retweets', len(retweetsdf))
+    gauge('multi_references', multi_ref_count)
 
     return tweetsdf, retweetsdf
 
 
 
-def rt_source_to_target(tweetsdf, retweetsdf, ref_col='referenced_tweet_id', id_col='tweet_id', author_col='author_id', v=False):
+@staged
+def rt_source_to_target(tweetsdf, retweetsdf, ref_col='referenced_tweet_id', id_col='tweet_id', author_col='author_id', method='index', v=False):
     '''
     Takes a list of tweets and a list of retweets and identify source, targets,
     and counts number of timers a source connects to a targer (link weight)
@@ -49,62 +67,219 @@ def rt_source_to_target(tweetsdf, retweetsdf, ref_col='referenced_tweet_id', id_
     -----
     tweetsdf: data frame
     retweetsdf: data frame
+    method: 'index' resolves all referenced ids at once through a tweet id -> author
+        index (hash join), 'scan' is the original row by row lookup (with a progress bar if v).
+        Tables (format_tweets(..., table=True)) are joined on their id arrays with 'index',
+        and scanned as data frames.
     
     Returns:
     -------
     "Connection list": list of all instances of connections between tweeters and retweeters.
     '''
+    if method == 'scan' and isinstance(retweetsdf, TweetTable):
+        tweetsdf, retweetsdf = tweetsdf.to_frame(), retweetsdf.to_frame()
+
+    if method == 'index' and isinstance(retweetsdf, TweetTable):
+        return _rt_table_join(tweetsdf, retweetsdf, ref_col=ref_col, id_col=id_col, author_col=author_col, v=v)
+    elif method == 'index':
+        return _rt_index_join(tweetsdf, retweetsdf, ref_col=ref_col, id_col=id_col, author_col=author_col, v=v)
+    elif method != 'scan':
+        raise ValueError('Unknown method {}, use "index" or "scan".'. format(method))
+
     connectionlist = []
     data_issues = []
     non_match_tracker = 0
     t0 = time()
 
-    for i in range(0, len(retweetsdf)):
-        # 99.9999% done in 12:29:59.999762
-
+    for i in progress(range(0, len(retweetsdf)), desc='retweets', show=v or None):
         retweet = retweetsdf.iloc[i]
         original_ids = retweet[ref_col]
-        v and print('Retweet no. {}:\n{}'. format(i, retweet))
 
         for oid in original_ids:
             original_tweet = tweetsdf.loc[tweetsdf[id_col] == oid]
-            v and print('ORIGINAL TWEET:\n{}'. format(original_tweet))
             
             if len(original_tweet[author_col].values) == 1: 
                 connection = {'source': original_tweet[author_col].values[0], 'target': retweet[author_col]}
-                v and print('Recording connection: {}\n******\n'. format(connection)) 
                 connectionlist.append(connection)
             
             elif len(original_tweet[author_col].values) > 1:
-                v and print('More than one match!!!\n{}\n******\n'. format(original_tweet))
                 data_issues.append((retweet, original_tweet))
             
             else:
-                v and print('No matches.\n******\n')
                 non_match_tracker += 1
-            
-            v and print('{:.4f}% done in {} .\n\n'. format((i/len(retweetsdf))*100, timedelta(seconds=time()-t0)))
+
+    _count_references(connectionlist, data_issues, non_match_tracker)
+    v and print('{} connections, {} multiple matches, {} without match in {}.'. format(len(connectionlist), len(data_issues), non_match_tracker, timedelta(seconds=time()-t0)))
     
     return connectionlist, data_issues, non_match_tracker
 
 
 
-def process_hashtags(tweetsdf, tag_col='tags', tagusefp=None, tagspertweetfp=None, v=True, vv=False):
-    ''' '''
+def _count_references(connectionlist, data_issues, non_match_tracker):
+    gauge('references', len(connectionlist) + len(data_issues) + non_match_tracker)
+    gauge('connections', len(connectionlist))
+    gauge('multiple_matches', len(data_issues))
+    gauge('non_matches', non_match_tracker)
+
+
+
+def _multiple_matches(tweetsdf, retweetsdf, rows, oids, id_col='tweet_id'):
+    '''
+    (retweet, original tweets) of every reference, given as retweet row and referenced id,
+    that matches more than one tweet, with the rows of the matching tweets looked up in
+    one grouping of the duplicated ids. Data frames or TweetTables, which are converted
+    only if there are such references.
+    '''
+    # ids with more than one match are kept for inspection, like the scan does
+    if not len(rows):
+        return []
+    tweetsdf = tweetsdf.to_frame() if isinstance(tweetsdf, TweetTable) else tweetsdf
+    retweetsdf = retweetsdf.to_frame() if isinstance(retweetsdf, TweetTable) else retweetsdf
+
+    # positions of the tweets of every duplicated id, grouped once instead of a scan per reference
+    ids = tweetsdf[id_col].values
+    duplicated = np.flatnonzero(pd.Series(ids).duplicated(keep=False).values)
+    groups = pd.Series(duplicated).groupby(ids[duplicated]).indices
+    originals = {oid: tweetsdf.iloc[duplicated[groups[oid]]] for oid in set(oids)}
+    return [(retweetsdf.iloc[i], originals[oid]) for i, oid in zip(rows, oids)]
+
+
+
+def _rt_index_join(tweetsdf, retweetsdf, ref_col='referenced_tweet_id', id_col='tweet_id', author_col='author_id', v=False):
+    '''
+    Vectorized version of rt_source_to_target.
+    Explodes the referenced ids of every retweet and looks up the original author
+    in a tweet id -> author index built once, instead of scanning tweetsdf per reference.
+    Output is the same as the row by row scan (same order of connections).
+    '''
+    t0 = time()
+
+    # one row per (retweet, referenced id), index is the retweet position
+    refs = retweetsdf[ref_col].reset_index(drop=True).explode().dropna()
+    targets = retweetsdf[author_col].values[refs.index.values]
+
+    # how many tweets carry each id, ids occurring once go into the author index
+    id_counts = tweetsdf[id_col].value_counts()
+    matches = refs.map(id_counts).fillna(0).values
+    unique_tweets = tweetsdf.drop_duplicates(subset=id_col, keep=False)
+    author_index = pd.Series(unique_tweets[author_col].values, index=unique_tweets[id_col].values)
+
+    single = matches == 1
+    sources = refs[single].map(author_index).values
+    connectionlist = [{'source': s, 'target': t} for s, t in zip(sources, targets[single])]
+
+    data_issues = _multiple_matches(tweetsdf, retweetsdf, refs.index[matches > 1], refs[matches > 1], id_col=id_col)
+
+    non_match_tracker = int((matches == 0).sum())
+    _count_references(connectionlist, data_issues, non_match_tracker)
+
+    v and print('{} references resolved in {}: {} connections, {} multiple matches, {} without match.'. format(len(refs), timedelta(seconds=time()-t0), len(connectionlist), len(data_issues), non_match_tracker))
+
+    return connectionlist, data_issues, non_match_tracker
+
+
+
+def id_index(tweets, id_col='tweet_id', author_col='author_id'):
+    '''
+    Tweet ids of a tweets TweetTable sorted (stable), with the author of every sorted id,
+    to look up references in with resolve_references.
+
+    Returns:
+    -------
+    sorted_ids, authors
+    '''
+    ids = np.asarray(tweets[id_col])
+    order = np.argsort(ids, kind='stable')
+    return ids[order], np.asarray(tweets[author_col])[order]
+
+
+
+def resolve_references(tweets, retweets, ref_col='referenced_tweet_id', id_col='tweet_id', author_col='author_id', index=None):
+    '''
+    Look up every reference of a retweets TweetTable in the sorted tweet ids of a tweets TweetTable.
+
+    Args:
+    -----
+    index: id_index of tweets, computed here if None; pass it to look up several retweet
+        chunks without sorting the tweet ids again
+
+    Returns:
+    -------
+    rows: retweet row of every reference
+    refs: referenced tweet id
+    matches: number of tweets with that id
+    sources: author of the (first) matching tweet, -1 without match
+    '''
+    rows, refs = retweets.explode(ref_col)
+    sorted_ids, authors = id_index(tweets, id_col=id_col, author_col=author_col) if index is None else index
+    first = np.searchsorted(sorted_ids, refs, side='left')
+    matches = np.searchsorted(sorted_ids, refs, side='right') - first
+    sources = np.full(len(refs), -1, dtype=np.int64)
+    sources[matches > 0] = authors[first[matches > 0]]
+    return rows, refs, matches, sources
+
+
+
+def _rt_table_join(tweets, retweets, ref_col='referenced_tweet_id', id_col='tweet_id', author_col='author_id', v=False):
+    '''
+    _rt_index_join on TweetTables: the referenced ids are looked up in the sorted tweet ids
+    with searchsorted. Same connections, data issues and non matches as on the data frames.
+    '''
+    t0 = time()
+
+    rows, refs, matches, sources = resolve_references(tweets, retweets, ref_col=ref_col, id_col=id_col, author_col=author_col)
+    targets = np.asarray(retweets[author_col])[rows]
+
+    single = matches == 1
+    connectionlist = [{'source': s, 'target': t} for s, t in zip(tweets.labels(sources[single]), retweets.labels(targets[single]))]
+
+    data_issues = _multiple_matches(tweets, retweets, rows[matches > 1], tweets.labels(refs[matches > 1]), id_col=id_col)
+
+    non_match_tracker = int((matches == 0).sum())
+    _count_references(connectionlist, data_issues, non_match_tracker)
+
+    v and print('{} references resolved in {}: {} connections, {} multiple matches, {} without match.'. format(len(refs), timedelta(seconds=time()-t0), len(connectionlist), len(data_issues), non_match_tracker))
+
+    return connectionlist, data_issues, non_match_tracker
+
+
+
+@staged
+def process_hashtags(tweetsdf, tag_col='tags', tagusefp=None, tagspertweetfp=None, labels=None, chunksize=1000000, v=True, vv=False):
+    '''
+    tweetsdf: data frame or columnar.TweetTable
+    labels: vocab.Vocabulary of the tags if the tags column holds codes, used to print the top tags.
+    chunksize: tweets per update of the tag statistics (see tagstats.TagStats), the
+        summary and the figures are made from the accumulated counts.
+    '''
+    table = isinstance(tweetsdf, TweetTable)
+    tags = tweetsdf[tag_col]
+    lengths = tags.lengths() if table else tweetsdf[tag_col].str.len().values
+
+    stats = TagStats()
+    for start in range(0, len(tweetsdf), chunksize):
+        end = min(start + chunksize, len(tweetsdf))
+        if table:
+            values = tags.values[tags.offsets[start]:tags.offsets[end]]
+            stats.update(lengths[start:end], tweetsdf.tag_labels(values))
+        else:
+            stats.update(lengths[start:end], np.array([t for l in tags.iloc[start:end] for t in l], dtype=object))
+
+    use_threshold = 10
+    n_top = 40
+    summary = stats.summary(threshold=use_threshold, n_top=n_top)
 
     ### Number of tags per tweet ###
     # tweets with 0, 1, and more than 1 tags:
-    tweets_with_multiple_tags = tweetsdf[tweetsdf[tag_col].str.len() > 1]
-    tweets_with_one_tag = tweetsdf[tweetsdf[tag_col].str.len() == 1]
-    tweets_without_tags = tweetsdf[tweetsdf[tag_col].str.len() == 0]
     v and print('------\nTweets with no tags {} ({:.4f}%).\nTweets with one tag {} ({:.4f}%).\nTweets with multiple tags {} ({:.4f}%).'. 
-            format(len(tweets_without_tags), len(tweets_without_tags)/len(tweetsdf)*100,
-                len(tweets_with_one_tag), len(tweets_with_one_tag)/len(tweetsdf)*100,
-                len(tweets_with_multiple_tags), len(tweets_with_multiple_tags)/len(tweetsdf)*100))
+            format(summary['without_tags'], summary['without_tags_fraction']*100,
+                summary['one_tag'], summary['one_tag_fraction']*100,
+                summary['multiple_tags'], summary['multiple_tags_fraction']*100))
 
     if tagspertweetfp:
-        data = tweetsdf[tag_col].str.len().values
-        bins = max(data)
+        # histogram of the counts of tweets per number of tags
+        data = np.arange(len(stats.histogram))
+        bins = max(len(stats.histogram) - 1, 1)
         fig = plt.figure(figsize=(8,5))
         title = 'Distribution of number of tags per tweet'
         fig.suptitle(title)
@@ -112,36 +287,33 @@ def process_hashtags(tweetsdf, tag_col='tags', tagusefp=None, tagspertweetfp=Non
         ax1.set(ylabel='number of occurances', xlabel='number of tags per tweet')
         ax1.grid(axis='y', linestyle='--', linewidth=.42)
         params1 = dict(color='navy', alpha=.82, log=False, density=False, align='left', rwidth=.82)
-        ax1.hist(data, bins=bins, **params1)
+        ax1.hist(data, bins=bins, weights=stats.histogram, **params1)
         # add log version
         ax2 = fig.add_subplot(1,2,2)
         ax2.set(ylabel='', xlabel='number of tags per tweet')
         ax2.grid(axis='y', linestyle='--', linewidth=.42)
         params2 = dict(color='navy', alpha=.82, log=True, density=False, align='left', rwidth=.82)
-        ax2.hist(data, bins=bins, **params2)
+        ax2.hist(data, bins=bins, weights=stats.histogram, **params2)
         fig.savefig(tagspertweetfp)
         v and print('------\nFigure "{}" has been written to {}'. format(title, tagspertweetfp))
 
     # investigate tag usage distribution
-    tag_counts = tweets_with_multiple_tags[tag_col].explode().value_counts()
-    once_used_sum = sum(tag_counts == 1)
-    use_threshold = 10
-    n_top = 40
-    top_tags = tag_counts.head(n_top)
-    v and print('------\nAmount of unique tags: {}'. format(len(tag_counts)))
-    v and print('------\nAmount of tags used only once: {} ({:.2f}%)'. format(once_used_sum, once_used_sum/len(tag_counts)*100))
-    v and print('------\nAmount of tags used {} times or less: {} ({:.2f}%)'. format(use_threshold, sum(tag_counts <= use_threshold), sum(tag_counts <= use_threshold)/len(tag_counts)*100))
-    v and print('------\nTop {} tags:\n{}'. format(n_top, top_tags))
+    tag_counts = stats.counts(name=tag_col)
+    top_tags = summary['top']
+    v and print('------\nAmount of unique tags: {}'. format(summary['unique_tags']))
+    v and print('------\nAmount of tags used only once: {} ({:.2f}%)'. format(summary['used_once'], summary['used_once_fraction']*100))
+    v and print('------\nAmount of tags used {} times or less: {} ({:.2f}%)'. format(use_threshold, summary['used_threshold_or_less'], summary['used_threshold_or_less_fraction']*100))
+    v and print('------\nTop {} tags:\n{}'. format(n_top, top_tags if labels is None else top_tags.set_axis(labels.decode(top_tags.index))))
 
     if tagusefp:
         # uniform(-0.1, 0.1) adds jitter to x
         #i = [i+(i*r.uniform(-0.1, 0.1)) for i in range(0,len(tag_counts))]
-        x = [i for i in range(0,len(tag_counts))]
-        y = tag_counts
+        x = np.arange(len(tag_counts))
+        y = tag_counts.values
         if vv:
             print(len(tag_counts))
-            print([(tc, i) for tc, i in zip(tag_counts,i)][0:50])
-            print([(tc, i) for tc, i in zip(tag_counts,i)][-50:-1])
+            print([(tc, i) for tc, i in zip(y, x)][0:50])
+            print([(tc, i) for tc, i in zip(y, x)][-50:-1])
         fig = plt.figure()
         title = 'Distribution of hashtag usage'
         fig.suptitle(title)
@@ -153,23 +325,110 @@ def process_hashtags(tweetsdf, tag_col='tags', tagusefp=None, tagspertweetfp=Non
         fig.savefig(tagusefp)
         v and print('------\nFigure "{}" has been written to {}'. format(title, tagusefp))
 
+    gauge('tweets_without_tags', summary['without_tags'])
+    gauge('tweets_with_one_tag', summary['one_tag'])
+    gauge('tweets_with_multiple_tags', summary['multiple_tags'])
+    gauge('unique_tags', summary['unique_tags'])
+
     # hashtags used in a tweet without any other hashtags are not a part of the network
-    hashtags = tweets_with_multiple_tags[tag_col]
+    multiple = lengths > 1
+    if table:
+        hashtags = pd.Series(tweetsdf.take(multiple).to_frame([tag_col])[tag_col].values, index=np.flatnonzero(multiple), name=tag_col)
+    else:
+        hashtags = tweetsdf.loc[multiple, tag_col]
 
     return hashtags, tag_counts
 
 
 
-def ht_source_to_target(hashtags, htconnectionlistfp=None, v=False):
+def tag_pairs(tags):
+    '''
+    Every tag pair of every tweet with multiple tags, in the order of itertools.combinations.
+    tags: columnar.ListColumn (tags of a TweetTable)
+
+    Returns:
+    -------
+    rows, a, b: row of the tweet and the two tags (values of tags) of every pair
+    '''
+    lengths = tags.lengths()
+    rows, a, b = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+
+    # tweets with k tags at once
+    for k in np.unique(lengths[lengths > 1]):
+        with_k = np.flatnonzero(lengths == k)
+        block = np.asarray(tags.values)[tags.offsets[with_k][:, None] + np.arange(k)]
+        i, j = np.triu_indices(k, 1)
+        rows.append(np.repeat(with_k, len(i)))
+        a.append(block[:, i].ravel())
+        b.append(block[:, j].ravel())
+
+    return np.concatenate(rows), np.concatenate(a), np.concatenate(b)
+
+
+
+def ht_cooccurrence(hashtags):
+    '''
+    Weighted hashtag co-occurrence matrix.
+    Builds the sparse tweet x tag incidence matrix B (entry = number of times the tag
+    is used in the tweet) and returns the tag x tag adjacency B^T B with the diagonal zeroed.
+    Off-diagonal weights equal the number of tag pairs ht_source_to_target records.
+
+    Parameters
+    ----------
+    hashtags: series/list-like (tags column of tweetsdf)
+
+    Returns
+    -------
+    adjacency: scipy.sparse csr matrix (symmetric)
+    labels: array of tags, row/column i of adjacency is labels[i]
+    '''
+    hashtags = pd.Series(hashtags)
+    lengths = hashtags.str.len().fillna(0).astype(np.int64).values
+    rows = np.repeat(np.arange(len(hashtags)), lengths)
+    codes, labels = pd.factorize(np.array([t for tags in hashtags for t in tags], dtype=object), sort=True)
+
+    incidence = sparse.csr_matrix((np.ones(len(codes), dtype=np.int64), (rows, codes)), shape=(len(hashtags), len(labels)))
+    adjacency = (incidence.T @ incidence).tocsr()
+    adjacency.setdiag(0)
+    adjacency.eliminate_zeros()
+
+    return adjacency, np.asarray(labels, dtype=object)
+
+
+
+@staged
+def ht_source_to_target(hashtags, htconnectionlistfp=None, method='combinations', v=False):
     '''
     A hashtag is linked to another if they appreared in the same tweet
     Parameters
     ----------
     hashtags: series/list-like (tags column of tweetsdf)
+    method: 'combinations' records one {'source', 'target'} dict per tag pair of every tweet,
+        'sparse' returns the weighted edges (source, target, weight data frame) of the
+        co-occurrence matrix (see ht_cooccurrence) without materializing the pairs.
+        Both can be passed to write_edgelist and give the same edgelist, except that
+        'sparse' has no self-references to report.
     '''
 
     # check length of tag arrays
     v and print('Min length tag array: {}. Max length tag array: {}.'. format(min(hashtags.str.len()), max(hashtags.str.len())))
+
+    if method == 'sparse':
+        adjacency, labels = ht_cooccurrence(hashtags)
+        upper = sparse.triu(adjacency, k=1).tocoo()
+        htedges = pd.DataFrame({'source': labels[upper.row], 'target': labels[upper.col], 'weight': upper.data})
+        v and print('{} weighted connections recorded ({} tag pairs without self-references).'. format(len(htedges), htedges['weight'].sum()))
+        gauge('unique_edges', len(htedges))
+        gauge('tag_pairs', int(htedges['weight'].sum()))
+
+        if htconnectionlistfp:
+            htedges.to_json(htconnectionlistfp, orient='records')
+            v and print('-----\nHashtag connectionlist written to file {}.'. format(htconnectionlistfp))
+
+        return htedges
+
+    elif method != 'combinations':
+        raise ValueError('Unknown method {}, use "combinations" or "sparse".'. format(method))
    
     combinationsdf = hashtags.apply(lambda x: [c for c in it.combinations(x,2)])
 
@@ -180,6 +439,7 @@ def ht_source_to_target(hashtags, htconnectionlistfp=None, v=False):
     num_of_pairs = sum(combinationsdf.str.len())
     htconnectionlist = [{'source': i[0], 'target': i[1]} for i in it.chain(*combinationsdf.values)]
     v and print('{} connections recorded (should be {}).'. format(num_of_pairs, len(htconnectionlist)))
+    gauge('tag_pairs', len(htconnectionlist))
 
     if htconnectionlistfp:
         with open(htconnectionlistfp, 'w') as f:
@@ -189,52 +449,78 @@ def ht_source_to_target(hashtags, htconnectionlistfp=None, v=False):
     return htconnectionlist
 
 
-def write_edgelist(connectionlist, filepath=None, v=True, vv=False):
-    '''Writes edgelist file. '''
-    
-    c = Counter()    
-    connectiondf = pd.DataFrame(connectionlist)
-    setname = 'sourcetargetfs'
-    links = []
-    self_ref = 0
+def aggregate_edges(sources, targets, weights=None):
+    '''
+    Count undirected edges between integer node codes.
+    Pairs are canonicalized as (min, max) and counted with a sort based unique.
 
-    # transform connection list into frozen set
-    connectiondf[setname] = [frozenset([i, j]) for i, j in zip(connectiondf['source'], connectiondf['target'])]
+    Returns:
+    -------
+    lo, hi, weight: arrays of the unique pairs sorted by (lo, hi), self-loops included
+    '''
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    lo = np.minimum(sources, targets)
+    hi = np.maximum(sources, targets)
+    n = int(hi.max()) + 1 if len(hi) else 0
 
-    # count occurances of each set
-    for fs in connectiondf[setname]:
-        c[fs] += 1
+    keys, inverse = np.unique(lo * n + hi, return_inverse=True)
+    if weights is None:
+        weight = np.bincount(inverse.ravel(), minlength=len(keys))
+    else:
+        weight = np.bincount(inverse.ravel(), weights=weights, minlength=len(keys))
+        if np.all(np.mod(weight, 1) == 0):
+            weight = weight.astype(np.int64)
 
-    unique_connections = c.items()
-    # the order of Counter.items() might be non-deterministic
-    v and print('------\nThere are {} unique connections'. format(len(unique_connections)))
+    return keys // max(n, 1), keys % max(n, 1), weight
 
-    # parse links
-    for i in unique_connections:
 
-        if len(i[0]) == 1:
-            # author retweeted/replied/quoted themselves
-            # hashtag used twice
-            # network does not have self loops
-            self_ref += 1
-        
-        elif len(i[0]) == 2:
-            # correct length
-            sourcetarget = list(i[0])
-            source = sourcetarget[0]
-            target = sourcetarget[1]
-            count = i[1]
-            link = source + ' ' + target + ' ' + str(count) + '\n'
-            vv and print(link)
-            links.append(link)
 
-        else:
-            print('source target length issue:\n{}'. format(i))
+@staged
+def write_edgelist(connectionlist, filepath=None, labels=None, chunksize=500000, v=True, vv=False):
+    '''
+    Writes edgelist file.
+    connectionlist: list of {'source', 'target'} dicts, or a data frame / dict of arrays with
+        'source' and 'target' columns and optionally 'weight' (a row then counts weight times).
+    labels: vocab.Vocabulary, if source and target are codes they are written as labels.
+    Without labels, codes are written as they are (read back with nodetype=int).
 
-    v and print('------\n{} ({:.2f}%) are self-references (for tweet network author retweets/replies/qoutes themselves, for hashtags, tag is used twice in the same tweet).\nThese are not included in the edgelist (no self-loops).'. format(self_ref, self_ref/len(unique_connections)*100))
-    v and print('------\n{} links recorded. Example link:\n{}'. format(len(links), links[-10]))
+    Edges are undirected, self-loops are dropped. The edgelist is sorted by
+    (source, target) with source < target and written in chunks of `chunksize` lines.
+
+    Returns:
+    -------
+    Data frame of the weighted edges (source, target, weight).
+    '''
+    connectiondf = pd.DataFrame(connectionlist)
+    if len(connectiondf) == 0:
+        connectiondf = pd.DataFrame(columns=['source', 'target'])
+
+    # joint sorted codes of all nodes, so edges come out sorted by node
+    codes, nodes = pd.factorize(np.concatenate([connectiondf['source'].values, connectiondf['target'].values]), sort=True)
+    nodes = np.asarray(nodes, dtype=object) if labels is None else labels.decode(np.asarray(nodes))
+    weights = connectiondf['weight'].values if 'weight' in connectiondf else None
+    lo, hi, weight = aggregate_edges(codes[:len(connectiondf)], codes[len(connectiondf):], weights=weights)
+    v and print('------\nThere are {} unique connections'. format(len(weight)))
+
+    # author retweeted/replied/quoted themselves
+    # hashtag used twice
+    # network does not have self loops
+    self_loops = lo == hi
+    self_ref = int(self_loops.sum())
+    gauge('connections', int(weight.sum()))
+    gauge('unique_edges', len(weight))
+    gauge('self_loops', self_ref)
+    edges = pd.DataFrame({'source': nodes[lo[~self_loops]], 'target': nodes[hi[~self_loops]], 'weight': weight[~self_loops]})
+
+    v and print('------\n{} ({:.2f}%) are self-references (for tweet network author retweets/replies/qoutes themselves, for hashtags, tag is used twice in the same tweet).\nThese are not included in the edgelist (no self-loops).'. format(self_ref, self_ref/max(len(weight), 1)*100))
+    v and print('------\n{} links recorded. Example link:\n{}'. format(len(edges), edges.tail(1).to_string(header=False, index=False)))
+    vv and print(edges)
 
     if filepath:
         with open(filepath, 'w') as f:
-            f.writelines(links)
+            for start in range(0, len(edges), chunksize):
+                edges.iloc[start:start+chunksize].to_csv(f, sep=' ', header=False, index=False)
         v and print('-----\nEdgelist written to file {}.'. format(filepath))
+
+    return edges
@@ -0,0 +1,326 @@
+'''
+Columnar on-disk format for parsed tweets.
+
+A dataset (retweets, original_tweets or data_issue) is a directory with one .npy file
+per column and a meta.json with the number of rows, whether ids and tags are vocabulary
+codes (interned) and the columns:
+    tweet_id, author_id: int64
+    created_at: datetime64[ms]
+    tags: list column, int32 codes into the string dictionary, or the tag codes of
+        vocab.Vocabulary when the records were interned
+    referenced_tweet_id: list column, int64
+    ref_type: list column sharing the offsets of referenced_tweet_id, int32 codes into
+        the string dictionary (replaces the redundant full_ref_data)
+List columns are stored as a flat values array and an offsets array of length rows + 1,
+the string dictionary as utf-8 bytes and offsets. Everything is memory mapped on read,
+so only the columns that are accessed are paged in.
+
+The same layout is used in memory by TweetTable, a compact alternative to the data frames
+of build_net.format_tweets (no python object per id, tag or reference) with vectorized
+list lengths and explodes, and to_frame() for the data frame view.
+'''
+from pathlib import Path
+import json
+import numpy as np
+import pandas as pd
+
+
+ID_COLS = ('tweet_id', 'author_id')
+
+
+class ListColumn:
+    '''
+    A column of variable length lists stored as flat values and offsets,
+    entry i is values[offsets[i]:offsets[i+1]].
+    '''
+
+    def __init__(self, values, offsets):
+        self.values = values
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.values[self.offsets[i]:self.offsets[i+1]]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def rows(self):
+        '''Row index of every value, for exploding the column.'''
+        return np.repeat(np.arange(len(self)), self.lengths())
+
+    def take(self, rows):
+        '''Entries at rows (integer array) as a new ListColumn.'''
+        lengths = self.lengths()[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # position of every kept value in the flat values array
+        index = np.repeat(self.offsets[rows] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return ListColumn(self.values[index], offsets)
+
+    def tolist(self, labels=None):
+        values = self.values if labels is None else labels[np.asarray(self.values)]
+        return [list(values[s:e]) for s, e in zip(self.offsets[:-1], self.offsets[1:])]
+
+    @classmethod
+    def from_lists(cls, lists, dtype=None):
+        lengths = np.fromiter((len(l) for l in lists), dtype=np.int64, count=len(lists))
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        values = np.array([i for l in lists for i in l], dtype=dtype)
+        return cls(values, offsets)
+
+
+
+def encode_strings(strings):
+    '''Encode a sequence of strings as (utf-8 bytes, offsets).'''
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return data, offsets
+
+
+
+def decode_strings(data, offsets):
+    '''Inverse of encode_strings, returns an object array of strings.'''
+    raw = bytes(data)
+    return np.array([raw[s:e].decode('utf-8') for s, e in zip(offsets[:-1], offsets[1:])], dtype=object)
+
+
+
+class TweetTable:
+    '''
+    The tweets of one dataset as arrays (the columns of the format above):
+    tweet_id, author_id and created_at arrays, tags, referenced_tweet_id and ref_type
+    ListColumns, with tag and reference type codes into `strings`. Ids and tags are
+    vocabulary codes if the records were interned. Datasets without references (original
+    tweets, data issues) keep their referenced_tweet_id (None or 'undefined') in constants.
+    '''
+
+    def __init__(self, columns, strings, rows, constants=None, interned=False):
+        self.columns = columns
+        self.strings = strings
+        self.rows = rows
+        self.constants = constants or {}
+        self.interned = interned
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, col):
+        return self.columns[col]
+
+    def __contains__(self, col):
+        return col in self.columns
+
+    def __repr__(self):
+        return 'TweetTable with {} rows and columns {}'. format(self.rows, ', '.join(self.columns))
+
+    @classmethod
+    def from_records(cls, records, interned=None):
+        '''
+        Table of a list of parsed tweet records (see parse.parse_tweet).
+        interned: whether the records carry vocabulary codes (see vocab.intern_records), by
+            default inferred from the type of their tweet ids
+        '''
+        columns, constants = {}, {}
+
+        for col in ID_COLS:
+            columns[col] = np.array([r[col] for r in records], dtype=np.int64)
+
+        created_at = pd.to_datetime([r['created_at'] for r in records], utc=True)
+        columns['created_at'] = created_at.tz_localize(None).values.astype('datetime64[ms]')
+
+        # strings (tags and reference types) share one dictionary
+        tags = ListColumn.from_lists([r['tags'] for r in records], dtype=object)
+        # interned records already carry vocabulary codes for the tags
+        if interned is None:
+            interned = len(records) > 0 and isinstance(records[0]['tweet_id'], (int, np.integer))
+        strings = [] if interned else [tags.values]
+        n_tag_strings = 0 if interned else len(tags.values)
+
+        refs = [r['referenced_tweet_id'] for r in records]
+        if all(isinstance(r, list) for r in refs):
+            ref_ids = ListColumn.from_lists(refs, dtype=np.int64)
+            ref_types = ListColumn.from_lists([[d['type'] for d in r['full_ref_data']] for r in records], dtype=object)
+            strings.append(ref_types.values)
+        elif len(set(refs)) <= 1:
+            # original tweets and data issues carry a constant (None or 'undefined')
+            ref_ids = None
+            constants['referenced_tweet_id'] = refs[0] if refs else None
+        else:
+            raise ValueError('Mixed referenced_tweet_id entries, cannot encode them as list column.')
+
+        flat = np.concatenate(strings) if sum(len(s) for s in strings) else np.array([], dtype=object)
+        codes, uniques = pd.factorize(flat)
+
+        tag_values = tags.values.astype(np.int32) if interned else codes[:n_tag_strings].astype(np.int32)
+        columns['tags'] = ListColumn(tag_values, tags.offsets)
+        if ref_ids is not None:
+            columns['referenced_tweet_id'] = ref_ids
+            columns['ref_type'] = ListColumn(codes[n_tag_strings:].astype(np.int32), ref_ids.offsets)
+
+        return cls(columns, np.asarray(uniques, dtype=object), len(records), constants, interned)
+
+    @classmethod
+    def read(cls, dirpath, columns=None, mmap=True):
+        '''Table of (columns of) a dataset written with write / write_columns, memory mapped unless mmap=False.'''
+        meta = read_meta(dirpath)
+        # datasets written before the interned flag was recorded have int32 tags only if interned
+        interned = meta.get('interned', meta['columns'].get('tags') == 'list[int32]')
+        return cls(read_columns(dirpath, columns, mmap=mmap), read_strings(dirpath), meta['rows'], meta['constants'], interned)
+
+    def write(self, dirpath):
+        dirpath = Path(dirpath)
+        dirpath.mkdir(parents=True, exist_ok=True)
+        types = dict(tweet_id='int64', author_id='int64', created_at='datetime64[ms]', tags='list[int32]' if self.interned else 'list[str]',
+                referenced_tweet_id='list[int64]', ref_type='list[str]')
+        meta = dict(rows=self.rows, columns={c: types[c] for c in self.columns}, constants=self.constants, interned=self.interned)
+
+        arrays = {}
+        for col, a in self.columns.items():
+            if isinstance(a, ListColumn):
+                arrays[col + '.values'] = a.values
+                # ref_type shares the offsets of referenced_tweet_id
+                if col != 'ref_type':
+                    arrays[col + '.offsets'] = a.offsets
+            else:
+                arrays[col] = a
+        arrays['strings.data'], arrays['strings.offsets'] = encode_strings(self.strings)
+
+        for name, a in arrays.items():
+            np.save(dirpath / (name + '.npy'), a)
+
+        with open(dirpath / 'meta.json', 'w') as f:
+            json.dump(meta, f)
+
+    def ref_lengths(self, ref_col='referenced_tweet_id'):
+        '''Number of referenced tweets of every row, 0 for datasets without references.'''
+        return self.columns[ref_col].lengths() if ref_col in self.columns else np.zeros(self.rows, dtype=np.int64)
+
+    def explode(self, col):
+        '''Row index and value of every value of a list column.'''
+        return self.columns[col].rows(), np.asarray(self.columns[col].values)
+
+    def take(self, rows):
+        '''Rows (integer array or boolean mask) as a new table.'''
+        rows = np.asarray(rows)
+        rows = np.flatnonzero(rows) if rows.dtype == bool else rows.astype(np.int64)
+        columns = {c: a.take(rows) if isinstance(a, ListColumn) else np.asarray(a)[rows] for c, a in self.columns.items()}
+        if 'ref_type' in columns:
+            columns['ref_type'].offsets = columns['referenced_tweet_id'].offsets
+        return TweetTable(columns, self.strings, len(rows), self.constants, self.interned)
+
+    def labels(self, ids):
+        '''Tweet or author ids as in the records: strings, or the codes if interned.'''
+        ids = np.asarray(ids)
+        return ids if self.interned else ids.astype(str).astype(object)
+
+    def tag_labels(self, codes):
+        '''Tags of tag codes as in the records: strings, or the codes if interned.'''
+        codes = np.asarray(codes)
+        return codes if self.interned else self.strings[codes]
+
+    def to_frame(self, columns=None):
+        '''
+        Data frame with the same layout as the parse_tweets records (string ids, created_at
+        strings, lists for tags and referenced ids), i.e. what format_tweets returns by default.
+        Interned tables keep their integer codes, including the ids of full_ref_data.
+        '''
+        label = int if self.interned else str
+        columns = list(columns or ['created_at', 'tweet_id', 'author_id', 'referenced_tweet_id', 'full_ref_data', 'tags'])
+        df = pd.DataFrame(index=pd.RangeIndex(self.rows))
+
+        for col in columns:
+            if col in ID_COLS:
+                df[col] = self.labels(self.columns[col])
+            elif col == 'created_at':
+                df[col] = [s + 'Z' for s in np.datetime_as_string(self.columns[col], unit='ms')]
+            elif col == 'tags':
+                df[col] = [[int(t) for t in l] for l in self.columns[col].tolist()] if self.interned else self.columns[col].tolist(self.strings)
+            elif col == 'referenced_tweet_id':
+                if col in self.columns:
+                    df[col] = [[label(i) for i in l] for l in self.columns[col].tolist()]
+                else:
+                    df[col] = self.constants.get(col)
+            elif col == 'full_ref_data':
+                if 'referenced_tweet_id' in self.columns:
+                    df[col] = [[{'type': t, 'id': label(i)} for t, i in zip(ts, ids)]
+                            for ts, ids in zip(self.columns['ref_type'].tolist(self.strings), self.columns['referenced_tweet_id'].tolist())]
+            else:
+                raise KeyError('Unknown column {}.'. format(col))
+
+        return df
+
+
+
+def write_columns(records, dirpath, interned=False, v=False):
+    '''
+    Write a list of parsed tweet records (see parse.parse_tweet) to `dirpath` in the columnar format.
+    interned: the records carry vocabulary codes (parsed with vocabs), recorded in meta.json
+    '''
+    TweetTable.from_records(records, interned=interned).write(dirpath)
+    v and print('wrote {} rows to {}'. format(len(records), dirpath))
+
+
+
+def read_meta(dirpath):
+    with open(Path(dirpath) / 'meta.json', 'r') as f:
+        return json.load(f)
+
+
+
+def read_columns(dirpath, columns=None, mmap=True):
+    '''
+    Read columns of a dataset written with write_columns.
+    Arrays are memory mapped unless mmap=False, list columns are returned as ListColumn
+    with codes as values; use read_strings to map tag and ref_type codes to strings.
+
+    Returns:
+    -------
+    dict of column name -> array / ListColumn
+    '''
+    dirpath = Path(dirpath)
+    meta = read_meta(dirpath)
+    mode = 'r' if mmap else None
+    load = lambda name: np.load(dirpath / (name + '.npy'), mmap_mode=mode)
+    out = {}
+
+    for col in columns or meta['columns']:
+        if col not in meta['columns']:
+            raise KeyError('Column {} not in {}.'. format(col, dirpath))
+        if meta['columns'][col].startswith('list'):
+            # ref_type shares the offsets of referenced_tweet_id
+            offsets = 'referenced_tweet_id' if col == 'ref_type' else col
+            out[col] = ListColumn(load(col + '.values'), load(offsets + '.offsets'))
+        else:
+            out[col] = load(col)
+
+    return out
+
+
+
+def read_strings(dirpath):
+    '''Returns the string dictionary of a dataset as an object array.'''
+    dirpath = Path(dirpath)
+    return decode_strings(np.load(dirpath / 'strings.data.npy'), np.load(dirpath / 'strings.offsets.npy'))
+
+
+
+def load_frame(dirpath, columns=None):
+    '''
+    Load a dataset as a data frame with the same layout as the parse_tweets records
+    (string ids, created_at strings, lists for tags and referenced ids), so it can be
+    passed to build_net.format_tweets. Only the requested columns are read.
+    Datasets of interned records (see vocab.py) keep their integer codes, including
+    the ids of full_ref_data.
+    '''
+    meta = read_meta(dirpath)
+    columns = list(columns or ['created_at', 'tweet_id', 'author_id', 'referenced_tweet_id', 'full_ref_data', 'tags'])
+    stored = [c for c in columns if c in meta['columns']]
+    if 'full_ref_data' in columns and 'referenced_tweet_id' in meta['columns']:
+        stored += [c for c in ('referenced_tweet_id', 'ref_type') if c not in stored]
+    return TweetTable.read(dirpath, stored).to_frame(columns)
@@ -0,0 +1,178 @@
+'''
+Undirected weighted graph stored as a symmetric scipy.sparse CSR adjacency matrix.
+
+Used by vis.py instead of networkx for large networks: loading, component sizes,
+the largest component, node strengths and edge weights are single vectorized
+operations on the matrix. A networkx graph is built only when asked for (to_networkx).
+'''
+import numpy as np
+import pandas as pd
+import networkx as nx
+from scipy import sparse
+from scipy.sparse import csgraph
+
+
+class CSRGraph:
+    '''
+    adjacency: symmetric scipy.sparse matrix of edge weights, no self-loops
+    labels: array of node labels, node i is labels[i]
+    '''
+
+    def __init__(self, adjacency, labels=None):
+        self.adjacency = sparse.csr_matrix(adjacency)
+        n = self.adjacency.shape[0]
+        self.labels = np.arange(n) if labels is None else np.asarray(labels)
+
+    def __len__(self):
+        return self.adjacency.shape[0]
+
+    def __repr__(self):
+        return 'CSRGraph with {} nodes and {} edges'. format(self.number_of_nodes(), self.number_of_edges())
+
+    @classmethod
+    def from_edges(cls, sources, targets, weights=None, labels=None):
+        '''
+        Graph from edges between integer node codes (0 .. len(labels)-1).
+        Weights of repeated edges are summed.
+        '''
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        weights = np.ones(len(sources)) if weights is None else np.asarray(weights, dtype=np.float64)
+        n = len(labels) if labels is not None else int(max(sources.max(initial=-1), targets.max(initial=-1))) + 1
+        keep = sources != targets
+        rows = np.concatenate([sources[keep], targets[keep]])
+        cols = np.concatenate([targets[keep], sources[keep]])
+        adjacency = sparse.csr_matrix((np.concatenate([weights[keep], weights[keep]]), (rows, cols)), shape=(n, n))
+        return cls(adjacency, labels)
+
+    @classmethod
+    def read_edgelist(cls, fp, nodetype=str):
+        '''Load a weighted edgelist as written by build_net.write_edgelist.'''
+        dtype = str if nodetype is str else nodetype
+        df = pd.read_csv(fp, sep=' ', header=None, names=['source', 'target', 'weight'],
+                dtype={'source': dtype, 'target': dtype, 'weight': np.float64}, na_filter=False)
+        codes, labels = pd.factorize(np.concatenate([df['source'].values, df['target'].values]))
+        return cls.from_edges(codes[:len(df)], codes[len(df):], df['weight'].values, labels=np.asarray(labels))
+
+    @classmethod
+    def read(cls, fp, nodetype=str):
+        '''Load a graph saved with save (.npz) or a weighted edgelist.'''
+        return cls.load(fp) if str(fp).endswith('.npz') else cls.read_edgelist(fp, nodetype=nodetype)
+
+    @classmethod
+    def from_networkx(cls, g, weight='weight'):
+        labels = np.empty(g.number_of_nodes(), dtype=object)
+        labels[:] = list(g.nodes())
+        index = {n: i for i, n in enumerate(labels)}
+        edges = np.array([(index[s], index[t], d.get(weight, 1)) for s, t, d in g.edges(data=True)], dtype=np.float64).reshape(-1, 3)
+        return cls.from_edges(edges[:, 0], edges[:, 1], edges[:, 2], labels=labels)
+
+    def save(self, fp):
+        '''Binary format: the CSR arrays and labels in one .npz file.'''
+        a = self.adjacency
+        np.savez(fp, data=a.data, indices=a.indices, indptr=a.indptr, shape=a.shape, labels=self.labels.astype(str) if self.labels.dtype == object else self.labels)
+
+    @classmethod
+    def load(cls, fp):
+        with np.load(fp) as f:
+            adjacency = sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            return cls(adjacency, f['labels'].astype(object) if f['labels'].dtype.kind == 'U' else f['labels'])
+
+    def to_networkx(self):
+        '''networkx graph with the same labels and weights, for algorithms not available here.'''
+        g = nx.Graph()
+        g.add_nodes_from(self.labels)
+        i, j, w = self.edges()
+        g.add_weighted_edges_from(zip(self.labels[i], self.labels[j], w))
+        return g
+
+    def number_of_nodes(self):
+        return self.adjacency.shape[0]
+
+    def number_of_edges(self):
+        return self.adjacency.nnz // 2
+
+    def edges(self):
+        '''Node codes and weights (i, j, w) of every edge, i < j.'''
+        upper = sparse.triu(self.adjacency, k=1).tocoo()
+        return upper.row, upper.col, upper.data
+
+    def weights(self):
+        return self.edges()[2]
+
+    def degrees(self):
+        return np.diff(self.adjacency.indptr)
+
+    def strengths(self):
+        '''Weighted degree of every node.'''
+        return np.asarray(self.adjacency.sum(axis=1)).ravel()
+
+    def components(self):
+        '''Number of connected components and the component of every node.'''
+        return csgraph.connected_components(self.adjacency, directed=False)
+
+    def component_sizes(self):
+        '''Sizes of the connected components, largest first.'''
+        n, component = self.components()
+        return np.sort(np.bincount(component, minlength=n))[::-1]
+
+    def subgraph(self, nodes):
+        '''Induced subgraph on an array of node codes (or a boolean mask).'''
+        nodes = np.flatnonzero(nodes) if np.asarray(nodes).dtype == bool else np.asarray(nodes)
+        return CSRGraph(self.adjacency[nodes][:, nodes], self.labels[nodes])
+
+    def largest_component_mask(self):
+        '''Boolean mask of the nodes in the largest connected component.'''
+        n, component = self.components()
+        if n == 0:
+            return np.zeros(0, dtype=bool)
+        return component == np.argmax(np.bincount(component))
+
+    def largest_component(self):
+        return self.subgraph(self.largest_component_mask())
+
+    def clustering(self, max_weight=None):
+        '''
+        Weighted clustering coefficient of every node, same definition as
+        nx.clustering(g, weight='weight') (geometric mean of the normalized edge weights).
+        max_weight defaults to the largest weight of the graph.
+        '''
+        return weighted_clustering(self.adjacency, max_weight=max_weight)
+
+
+
+def weighted_clustering(adjacency, max_weight=None, block_nnz=2 ** 24):
+    '''
+    Weighted clustering coefficients of a symmetric adjacency matrix without self-loops:
+        c_i = 1 / (k_i (k_i - 1)) * sum_jk (w_ij w_jk w_ki / max_weight**3) ** (1/3)
+    The triangle sums are the diagonal of W^3 for W = (A / max_weight) ** (1/3),
+    computed as rowsum((W[rows] @ W) * W[rows]) in blocks of consecutive rows. Row i of
+    W @ W has at most min(n, sum of k_j over the neighbours j of i) entries, blocks are cut
+    so that this bound stays under `block_nnz` entries, a hub row above it is a block of its own.
+    Coefficients are local, rescaling by max_weight gives those of a subgraph with a
+    different largest weight: c_sub = c * max_weight / max_weight_sub.
+    '''
+    a = sparse.csr_matrix(adjacency)
+    n = a.shape[0]
+    if max_weight is None:
+        max_weight = a.data.max() if a.nnz else 1
+
+    w = a.astype(np.float64)
+    w.data = np.cbrt(w.data / max_weight)
+
+    degree = np.diff(a.indptr)
+    pattern = sparse.csr_matrix((np.ones(a.nnz, dtype=np.int64), a.indices, a.indptr), shape=a.shape)
+    cost = np.minimum(pattern @ degree.astype(np.int64), n)
+    before = np.concatenate([[0], np.cumsum(cost)])
+
+    triangles = np.zeros(n)
+    start = 0
+    while start < n:
+        stop = max(int(np.searchsorted(before, before[start] + block_nnz, side='right')) - 1, start + 1)
+        rows = w[start:stop]
+        triangles[start:stop] = np.asarray((rows @ w).multiply(rows).sum(axis=1)).ravel()
+        start = stop
+
+    k = np.diff(a.indptr).astype(np.float64)
+    pairs = k * (k - 1)
+    return np.divide(triangles, pairs, out=np.zeros(n), where=pairs > 0)
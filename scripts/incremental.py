@@ -0,0 +1,246 @@
+'''
+Incremental update of the retweet and hashtag edgelists.
+
+A state directory keeps what is needed to fold new data files into the networks
+without re-reading the old ones:
+    files.json: data files already ingested
+    vocab_authors.json, vocab_tags.json: node vocabularies (see vocab.py)
+    index.npz: tweet id -> author code of all original tweets, sorted by tweet id,
+        with a flag for ids seen more than once
+    pending.npz: references (referenced tweet id, retweeter author code, age) whose original
+        tweet has not been seen yet, they are resolved when it arrives or dropped once they
+        have waited max_pending_age updates with new files
+    rt_edges.npz, ht_edges.npz: accumulated edge weights (lo, hi, weight) in node codes,
+        sorted by (lo, hi)
+
+An update only sorts and aggregates the new data: new tweet ids and edges are merged into
+the sorted index and edges with searchsorted, pending references are bounded by their age.
+The edgelists are written from the accumulated edges in node code order, which costs their
+size but no sort; update_networks(sort=True) writes them in the order of
+build_net.write_edgelist instead, at the cost of sorting all edges.
+'''
+from pathlib import Path
+import glob
+import json
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from parse import parse_files
+from build_net import aggregate_edges, ht_cooccurrence
+from vocab import Vocabulary
+
+EMPTY_EDGES = dict(lo=np.zeros(0, dtype=np.int64), hi=np.zeros(0, dtype=np.int64), weight=np.zeros(0, dtype=np.int64))
+
+
+def _ids(ids):
+    return np.fromiter((int(i) for i in ids), dtype=np.int64, count=len(ids))
+
+
+
+def _load_npz(fp, default):
+    if not Path(fp).exists():
+        return dict(default)
+    with np.load(fp) as f:
+        return {k: f[k] for k in f.files}
+
+
+
+def load_state(statedir):
+    '''Load the incremental state from `statedir`, or an empty state if there is none yet.'''
+    statedir = Path(statedir)
+    files_fp = statedir / 'files.json'
+    state = dict(files=[])
+
+    if files_fp.exists():
+        with open(files_fp, 'r') as f:
+            state['files'] = json.load(f)
+
+    for e in ('authors', 'tags'):
+        fp = statedir / ('vocab_' + e + '.json')
+        state[e] = Vocabulary.load(fp) if fp.exists() else Vocabulary()
+
+    state['index'] = _load_npz(statedir / 'index.npz', dict(tweet_id=np.zeros(0, dtype=np.int64), author=np.zeros(0, dtype=np.int64), ambiguous=np.zeros(0, dtype=bool)))
+    state['pending'] = _load_npz(statedir / 'pending.npz', dict(ref_id=np.zeros(0, dtype=np.int64), target=np.zeros(0, dtype=np.int64)))
+    # states saved before pending references had an age
+    state['pending'].setdefault('age', np.zeros(len(state['pending']['ref_id']), dtype=np.int64))
+    state['rt_edges'] = _load_npz(statedir / 'rt_edges.npz', EMPTY_EDGES)
+    state['ht_edges'] = _load_npz(statedir / 'ht_edges.npz', EMPTY_EDGES)
+
+    return state
+
+
+
+def save_state(state, statedir):
+    '''Write the state to `statedir`, the list of ingested files is written last.'''
+    statedir = Path(statedir)
+    statedir.mkdir(parents=True, exist_ok=True)
+
+    for e in ('authors', 'tags'):
+        state[e].save(statedir / ('vocab_' + e + '.json'))
+    for name in ('index', 'pending', 'rt_edges', 'ht_edges'):
+        np.savez(statedir / (name + '.npz'), **state[name])
+
+    with open(statedir / 'files.json', 'w') as f:
+        json.dump(state['files'], f)
+
+
+
+def update_index(index, tweet_ids, authors):
+    '''
+    Merge new original tweets into the sorted tweet id -> author index.
+    Ids occurring more than once are flagged ambiguous (like the multiple matches of
+    build_net.rt_source_to_target), the first author seen is kept.
+    Only the new ids are sorted, they are inserted at their searchsorted positions.
+    '''
+    ids, first, counts = np.unique(tweet_ids, return_index=True, return_counts=True)
+    author, ambiguous = authors[first], counts > 1
+
+    pos = np.searchsorted(index['tweet_id'], ids)
+    seen = pos < len(index['tweet_id'])
+    seen[seen] = index['tweet_id'][pos[seen]] == ids[seen]
+    # ids seen in an earlier update become ambiguous and keep their first author
+    old_ambiguous = index['ambiguous'].copy()
+    old_ambiguous[pos[seen]] = True
+
+    new = ~seen
+    return dict(tweet_id=np.insert(index['tweet_id'], pos[new], ids[new]), author=np.insert(index['author'], pos[new], author[new]),
+            ambiguous=np.insert(old_ambiguous, pos[new], ambiguous[new]))
+
+
+
+def resolve_references(index, ref_ids, targets):
+    '''
+    Look up the authors of referenced tweets in the index.
+
+    Returns:
+    -------
+    sources, targets of the resolved references, mask of unresolved references
+    and number of references to ambiguous ids
+    '''
+    pos = np.searchsorted(index['tweet_id'], ref_ids)
+    pos = np.minimum(pos, max(len(index['tweet_id']) - 1, 0))
+    found = (index['tweet_id'][pos] == ref_ids) if len(index['tweet_id']) else np.zeros(len(ref_ids), dtype=bool)
+    ambiguous = found & index['ambiguous'][pos] if len(index['tweet_id']) else found
+    resolved = found & ~ambiguous
+
+    return index['author'][pos[resolved]], targets[resolved], ~found, int(ambiguous.sum())
+
+
+
+def add_edges(edges, sources, targets, weights=None):
+    '''
+    Add edges to accumulated edge weights, self-loops are dropped. The new edges are
+    aggregated and merged into the sorted accumulated edges with searchsorted.
+    '''
+    keep = sources != targets
+    lo, hi, weight = aggregate_edges(sources[keep], targets[keep], weights=None if weights is None else weights[keep])
+    if not len(lo):
+        return edges
+
+    # (lo, hi) order is the order of lo * n + hi for any n above all codes
+    n = max(int(edges['hi'].max()) if len(edges['hi']) else 0, int(hi.max())) + 1
+    keys, new_keys = edges['lo'] * n + edges['hi'], lo * n + hi
+    pos = np.searchsorted(keys, new_keys)
+    found = pos < len(keys)
+    found[found] = keys[pos[found]] == new_keys[found]
+
+    old_weight = edges['weight'].copy()
+    old_weight[pos[found]] += weight[found].astype(np.int64)
+    new = ~found
+    return dict(lo=np.insert(edges['lo'], pos[new], lo[new]), hi=np.insert(edges['hi'], pos[new], hi[new]),
+            weight=np.insert(old_weight, pos[new], weight[new].astype(np.int64)))
+
+
+
+def _write(edges, labels, filepath, sort=False, chunksize=500000, v=False):
+    '''
+    Write accumulated edges (aggregated, without self-loops) as edgelist lines, with sort
+    in the (source, target) label order of build_net.write_edgelist, else in code order.
+    '''
+    lo, hi, weight = edges['lo'], edges['hi'], edges['weight']
+    if sort:
+        rank = np.empty(len(labels), dtype=np.int64)
+        rank[np.argsort(labels.decode(np.arange(len(labels))), kind='stable')] = np.arange(len(labels))
+        swap = rank[lo] > rank[hi]
+        lo, hi = np.where(swap, hi, lo), np.where(swap, lo, hi)
+        order = np.lexsort((rank[hi], rank[lo]))
+        lo, hi, weight = lo[order], hi[order], weight[order]
+
+    with open(filepath, 'w') as f:
+        for start in range(0, len(lo), chunksize):
+            chunk = slice(start, start + chunksize)
+            pd.DataFrame({'source': labels.decode(lo[chunk]), 'target': labels.decode(hi[chunk]), 'weight': weight[chunk]}
+                    ).to_csv(f, sep=' ', header=False, index=False)
+    v and print('-----\nEdgelist of {} links written to file {}.'. format(len(lo), filepath))
+
+
+
+def update_networks(pattern, reldir, root, statedir, rtedgelistfp=None, htedgelistfp=None, workers=None, max_pending_age=3,
+        max_pending=None, sort=False, v=False):
+    '''
+    Fold the data files matching `pattern` that were not ingested before into the
+    retweet and hashtag networks kept in `statedir`, and rewrite the edgelists.
+    Only new files are parsed; references to tweets that arrived earlier are resolved
+    through the stored index, references to tweets that have not arrived yet are kept
+    pending for at most `max_pending_age` later updates with new files, and at most
+    `max_pending` of them (the most recent) are kept. Edgelists have the edges and weights
+    of a full rebuild with rt_source_to_target, ht_source_to_target and write_edgelist on
+    the original tweets, as long as an original tweet id is not repeated in a later file
+    than a reference to it was resolved, and arrives at most max_pending_age updates after
+    the references to it.
+    sort: write the edgelists in the order of write_edgelist (sorting all edges), by
+        default they are written in node code order
+
+    Returns:
+    -------
+    dict with the numbers of new files, resolved, pending and dropped references
+    '''
+    state = load_state(statedir)
+    ingested = set(state['files'])
+    new_files = sorted(f for f in glob.iglob(root + reldir + pattern) if f not in ingested)
+    v and print('{} new files, {} files already ingested.'. format(len(new_files), len(ingested)))
+
+    parsed = parse_files(new_files, workers=workers, v=v)
+    originals = parsed['original_tweets']
+    retweets = parsed['retweets']
+    authors, tags = state['authors'], state['tags']
+
+    # index new original tweets
+    state['index'] = update_index(state['index'],
+            _ids([t['tweet_id'] for t in originals]),
+            authors.encode([t['author_id'] for t in originals]).astype(np.int64))
+
+    # new references plus the ones still waiting for their original tweet
+    ref_ids = [i for r in retweets for i in r['referenced_tweet_id']]
+    ref_targets = authors.encode([r['author_id'] for r in retweets for i in r['referenced_tweet_id']]).astype(np.int64)
+    # pending references only age when there is new data their originals could be in
+    ref_ages = np.concatenate([state['pending']['age'] + bool(new_files), np.zeros(len(ref_ids), dtype=np.int64)])
+    ref_ids = np.concatenate([state['pending']['ref_id'], _ids(ref_ids)])
+    ref_targets = np.concatenate([state['pending']['target'], ref_targets])
+
+    sources, targets, unresolved, n_ambiguous = resolve_references(state['index'], ref_ids, ref_targets)
+    # references to tweets outside of the corpus would otherwise be retried forever
+    pending = np.flatnonzero(unresolved & (ref_ages < max_pending_age))
+    if max_pending is not None and len(pending) > max_pending:
+        pending = np.sort(pending[np.argsort(ref_ages[pending], kind='stable')[:max_pending]])
+    n_dropped = int(unresolved.sum()) - len(pending)
+    state['pending'] = dict(ref_id=ref_ids[pending], target=ref_targets[pending], age=ref_ages[pending])
+    state['rt_edges'] = add_edges(state['rt_edges'], sources, targets)
+    v and print('{} references resolved, {} pending, {} dropped, {} to ambiguous tweet ids.'. format(len(sources), len(pending), n_dropped, n_ambiguous))
+
+    # hashtags of the new original tweets used with other hashtags
+    hashtags = pd.Series([[tags.add(tag) for tag in t['tags']] for t in originals if len(t['tags']) > 1], dtype=object)
+    if len(hashtags):
+        adjacency, codes = ht_cooccurrence(hashtags)
+        upper = sparse.triu(adjacency, k=1).tocoo()
+        codes = codes.astype(np.int64)
+        state['ht_edges'] = add_edges(state['ht_edges'], codes[upper.row], codes[upper.col], weights=upper.data.astype(np.int64))
+
+    state['files'] = state['files'] + new_files
+    save_state(state, statedir)
+    v and print('State saved to {}.'. format(statedir))
+
+    rtedgelistfp and _write(state['rt_edges'], authors, rtedgelistfp, sort=sort, v=v)
+    htedgelistfp and _write(state['ht_edges'], tags, htedgelistfp, sort=sort, v=v)
+
+    return dict(new_files=len(new_files), resolved=len(sources), pending=len(pending), dropped=n_dropped, ambiguous=n_ambiguous)
@@ -0,0 +1,174 @@
+'''
+Structured counters, timings and progress reporting of the processing stages.
+
+Functions wrap their work in `with stage('name'):`, or are decorated with @staged, and
+record what they did with count / gauge, e.g. files parsed, references without match or
+self-loops. A finished stage is a record of its wall time, memory and counters.
+By default the memory is the growth of the process peak during the stage (rss_growth_mb),
+and peak_rss_mb is None. With configure(stage_peaks=True) (linux), the high-water mark of
+the process is reset when a stage starts, so peak_rss_mb is the peak of the stage and
+rss_growth_mb how far it rose above the resident memory at the start. The reset also
+resets ru_maxrss, so it is only meant for runs that are measured, like the pipeline and
+the benchmark. The last `keep` records are kept in memory (records(), write()) and, if a
+sink is configured, every record is appended to a json lines file as its stage finishes,
+so runs in several processes can share one sink. Counting is a dict update, cheap enough
+for inner loops over records.
+
+progress() wraps an iterable in a tqdm bar refreshed at most every `mininterval` seconds
+when progress bars are on (configure(progress=True) or show=True), otherwise it returns
+the iterable as it is.
+
+usage:
+    import instrument
+    instrument.configure(sink='output/metrics.jsonl', progress=True)
+    ... run the pipeline ...
+    instrument.write('output/metrics.json')
+'''
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from time import time, perf_counter
+import json
+import resource
+import sys
+
+_config = dict(sink=None, progress=False, mininterval=1., stage_peaks=False)
+_records = deque(maxlen=10000)
+_stack = []
+# highest resident memory seen so far in every open stage, parallel to _stack
+_peaks = []
+
+
+def configure(sink=None, progress=False, mininterval=1., stage_peaks=False, keep=10000):
+    '''
+    sink: json lines file every finished stage is appended to, None to keep records in memory only
+    progress: show tqdm progress bars
+    mininterval: minimum seconds between progress bar refreshes
+    stage_peaks: measure the peak memory of every stage by resetting the high-water mark of the process
+    keep: number of the most recent records kept in memory
+    '''
+    global _records
+    _config.update(sink=sink, progress=progress, mininterval=mininterval, stage_peaks=stage_peaks)
+    if keep != _records.maxlen:
+        _records = deque(_records, maxlen=keep)
+
+
+
+def peak_rss_mb():
+    '''Peak resident memory of this process, since it started or since the last stage started with stage_peaks.'''
+    # ru_maxrss is in kilobytes on linux, bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2 ** 20
+
+
+
+def _status_mb(field):
+    '''A memory field of /proc/self/status (VmRSS, VmHWM) in MB, None if not available.'''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+
+
+def _reset_high_water():
+    '''Reset the high-water mark (VmHWM, and ru_maxrss with it) to the current resident memory.'''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+
+@contextmanager
+def stage(name, **info):
+    '''Time a stage and collect the counters recorded while it runs. Stages can be nested.'''
+    record = dict(stage=name, started=time(), **info)
+    counters = {}
+    # the peaks so far of the enclosing stages are kept before the high-water mark is reset
+    hwm = _status_mb('VmHWM')
+    _peaks[:] = [max(p, hwm) if p is not None and hwm is not None else None for p in _peaks]
+    rss = _status_mb('VmRSS') if _config['stage_peaks'] else None
+    _peaks.append(rss if rss is not None and _reset_high_water() else None)
+    process_peak = peak_rss_mb()
+    _stack.append(counters)
+    t = perf_counter()
+    try:
+        yield counters
+    finally:
+        seconds = perf_counter() - t
+        _stack.pop()
+        peak, hwm = _peaks.pop(), _status_mb('VmHWM')
+        peak = max(peak, hwm) if peak is not None and hwm is not None else None
+        if _peaks and _peaks[-1] is not None:
+            _peaks[-1] = max(_peaks[-1], peak) if peak is not None else None
+        # without a stage peak only the growth of the process peak is known
+        growth = peak - rss if peak is not None else peak_rss_mb() - process_peak
+        record.update(seconds=seconds, peak_rss_mb=peak, rss_growth_mb=growth, counters=counters)
+        _records.append(record)
+        if _config['sink']:
+            with open(_config['sink'], 'a') as f:
+                f.write(json.dumps(record, default=_to_json) + '\n')
+
+
+
+def staged(func):
+    '''Decorator running every call of func as a stage named after it.'''
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with stage(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+
+def count(name, n=1):
+    '''Add n to a counter of the current stage (no-op outside of a stage).'''
+    if _stack:
+        counters = _stack[-1]
+        counters[name] = counters.get(name, 0) + n
+
+
+
+def gauge(name, value):
+    '''Set a value of the current stage (no-op outside of a stage).'''
+    if _stack:
+        _stack[-1][name] = value
+
+
+
+def progress(iterable, total=None, desc=None, show=None):
+    '''Throttled tqdm progress bar over iterable if progress bars are on (or show), the iterable itself if not.'''
+    if not (_config['progress'] if show is None else show):
+        return iterable
+    from tqdm import tqdm
+    return tqdm(iterable, total=total, desc=desc, mininterval=_config['mininterval'], leave=False)
+
+
+
+def records(name=None):
+    '''Finished stage records (the last `keep`), all or those of stage `name`.'''
+    return [r for r in _records if name is None or r['stage'] == name]
+
+
+
+def reset():
+    _records.clear()
+
+
+
+def write(fp):
+    '''Write the finished stage records kept in memory as a json list.'''
+    with open(fp, 'w') as f:
+        json.dump(list(_records), f, indent=1, default=_to_json)
+
+
+
+def _to_json(o):
+    # numpy scalars
+    return o.item() if hasattr(o, 'item') else str(o)
@@ -0,0 +1,270 @@
+'''
+ForceAtlas2 layout on a sparse adjacency matrix, vectorized with numpy.
+
+Same model and defaults as fa2.ForceAtlas2 (linear attraction weighted by edge weight,
+repulsion scaling 2.0, gravity 1.0, mass = degree + 1, adaptive speed with jitter tolerance 1.0).
+Attraction is one sparse matrix product per iteration. Repulsion is exact for small graphs and
+approximated with a Barnes-Hut quadtree otherwise: at every level of the tree a node is repelled
+by the centers of mass of the cells that are well separated from its own cell (children of the
+neighbours of its parent cell that do not touch its cell), at the deepest level also by its
+own and neighbouring cells. Each level is a handful of array operations over all nodes.
+
+Positions can be checkpointed to `posfp` while the layout runs and resumed from it, and a
+previous layout can be reused as a warm start, settling only the new nodes.
+'''
+from pathlib import Path
+import json
+import os
+import numpy as np
+from scipy import sparse
+from csrgraph import CSRGraph
+
+EXACT_REPULSION_MAX_NODES = 2000
+
+
+def exact_repulsion(x, mass, coefficient):
+    d = x[:, None, :] - x[None, :, :]
+    d2 = (d ** 2).sum(axis=2)
+    np.fill_diagonal(d2, np.inf)
+    factor = coefficient * mass[:, None] * mass[None, :] / d2
+    return (d * factor[:, :, None]).sum(axis=1)
+
+
+
+def barnes_hut_repulsion(x, mass, coefficient, depth=None):
+    '''Approximate repulsion forces with a quadtree of `depth` levels (default ~1 node per leaf).'''
+    n = len(x)
+    depth = depth or int(np.clip(np.ceil(np.log(max(n, 2)) / np.log(4)), 2, 10))
+    lo = x.min(axis=0)
+    size = (x.max(axis=0) - lo).max() * (1 + 1e-9) or 1.
+    force = np.zeros_like(x)
+    everyone = np.arange(n)
+
+    for level in range(1, depth + 1):
+        k = 1 << level
+        cell = np.minimum(((x - lo) / size * k).astype(np.int64), k - 1)
+        flat = cell[:, 0] * k + cell[:, 1]
+        m = np.bincount(flat, weights=mass, minlength=k * k)
+        center = np.stack([np.bincount(flat, weights=mass * x[:, 0], minlength=k * k),
+                           np.bincount(flat, weights=mass * x[:, 1], minlength=k * k)], axis=1)
+        center /= np.maximum(m, 1e-300)[:, None]
+        parent = cell >> 1
+
+        # children of the parent's neighbours that do not touch the node's own cell
+        for ox in range(-2, 4):
+            for oy in range(-2, 4):
+                cx = 2 * parent[:, 0] + ox
+                cy = 2 * parent[:, 1] + oy
+                far = (np.abs(cx - cell[:, 0]) > 1) | (np.abs(cy - cell[:, 1]) > 1)
+                valid = far & (cx >= 0) & (cx < k) & (cy >= 0) & (cy < k)
+                nodes = everyone[valid]
+                idx = cx[valid] * k + cy[valid]
+                _apply_cells(force, x, mass, m[idx], center[idx], nodes, coefficient)
+
+        if level == depth:
+            # leaves: own and touching cells as point masses, the node itself removed from its own cell
+            for ox in range(-1, 2):
+                for oy in range(-1, 2):
+                    cx = cell[:, 0] + ox
+                    cy = cell[:, 1] + oy
+                    valid = (cx >= 0) & (cx < k) & (cy >= 0) & (cy < k)
+                    nodes = everyone[valid]
+                    idx = cx[valid] * k + cy[valid]
+                    cell_mass, cell_center = m[idx], center[idx]
+                    if ox == 0 and oy == 0:
+                        others = cell_mass - mass[nodes]
+                        cell_center = (cell_center * cell_mass[:, None] - x[nodes] * mass[nodes][:, None]) / np.maximum(others, 1e-300)[:, None]
+                        cell_mass = np.where(others > 1e-9, others, 0)
+                    _apply_cells(force, x, mass, cell_mass, cell_center, nodes, coefficient)
+
+    return force
+
+
+
+def _apply_cells(force, x, mass, cell_mass, cell_center, nodes, coefficient):
+    '''Add the repulsion of one point mass per node (nodes are unique).'''
+    d = x[nodes] - cell_center
+    d2 = (d ** 2).sum(axis=1)
+    ok = (d2 > 0) & (cell_mass > 0)
+    factor = np.zeros(len(nodes))
+    factor[ok] = coefficient * mass[nodes][ok] * cell_mass[ok] / d2[ok]
+    force[nodes] += d * factor[:, None]
+
+
+
+def forceatlas2(adjacency, pos=None, niter=100, fixed=None, scaling_ratio=2.0, gravity=1.0, jitter_tolerance=1.0,
+        barnes_hut=None, start=0, speed_state=None, checkpoint=None, checkpoint_every=0, seed=None, v=False):
+    '''
+    Run ForceAtlas2 iterations on a symmetric weighted adjacency matrix.
+
+    Args:
+    -----
+    pos: (n, 2) array of initial positions, random in the unit square if None
+    fixed: boolean mask of nodes that do not move
+    barnes_hut: approximate repulsion, by default for graphs of more than EXACT_REPULSION_MAX_NODES nodes
+    start, speed_state: iteration and speed state to resume from (see checkpoint)
+    checkpoint: callable(positions, iteration, speed_state), called every `checkpoint_every`
+        iterations and after the last one
+
+    Returns:
+    -------
+    positions: (n, 2) array
+    speed_state: dict(speed, speed_efficiency, force) to continue the layout later
+    '''
+    a = sparse.csr_matrix(adjacency, dtype=np.float64)
+    n = a.shape[0]
+    rng = np.random.default_rng(seed)
+    x = rng.random((n, 2)) if pos is None else np.array(pos, dtype=np.float64)
+    mass = np.diff(a.indptr) + 1.
+    strength = np.asarray(a.sum(axis=1)).ravel()
+    moving = np.ones(n, dtype=bool) if fixed is None else ~np.asarray(fixed, dtype=bool)
+    barnes_hut = n > EXACT_REPULSION_MAX_NODES if barnes_hut is None else barnes_hut
+    speed_state = dict(speed=1., speed_efficiency=1.) if speed_state is None else dict(speed_state)
+    speed, speed_efficiency = speed_state['speed'], speed_state['speed_efficiency']
+    old_force = np.array(speed_state.get('force', np.zeros_like(x)), dtype=np.float64).reshape(x.shape)
+
+    for i in range(start, niter):
+        # repulsion, gravity, attraction
+        force = barnes_hut_repulsion(x, mass, scaling_ratio) if barnes_hut else exact_repulsion(x, mass, scaling_ratio)
+        distance = np.sqrt((x ** 2).sum(axis=1))
+        factor = np.divide(mass * gravity, distance, out=np.zeros(n), where=distance > 0)
+        force -= x * factor[:, None]
+        force -= strength[:, None] * x - a @ x
+        force[~moving] = 0
+
+        # adaptive speed as in fa2.ForceAtlas2
+        swinging = mass * np.sqrt(((old_force - force) ** 2).sum(axis=1))
+        traction = .5 * mass * np.sqrt(((old_force + force) ** 2).sum(axis=1))
+        total_swinging, total_traction = swinging.sum(), traction.sum()
+
+        estimated_optimal_jt = .05 * np.sqrt(n)
+        min_jt = np.sqrt(estimated_optimal_jt)
+        jt = jitter_tolerance * max(min_jt, min(10, estimated_optimal_jt * total_traction / n ** 2))
+        min_speed_efficiency = .05
+        if total_traction and total_swinging / total_traction > 2.:
+            if speed_efficiency > min_speed_efficiency:
+                speed_efficiency *= .5
+            jt = max(jt, jitter_tolerance)
+        target_speed = np.inf if total_swinging == 0 else jt * speed_efficiency * total_traction / total_swinging
+        if total_swinging > jt * total_traction:
+            if speed_efficiency > min_speed_efficiency:
+                speed_efficiency *= .7
+        elif speed < 1000:
+            speed_efficiency *= 1.3
+        speed = speed + min(target_speed - speed, .5 * speed)
+
+        x += force * (speed / (1. + np.sqrt(speed * swinging)))[:, None]
+        old_force = force
+
+        if checkpoint and ((checkpoint_every and (i + 1) % checkpoint_every == 0) or i + 1 == niter):
+            checkpoint(x, i + 1, dict(speed=speed, speed_efficiency=speed_efficiency, force=old_force))
+        v and (i + 1) % 10 == 0 and print('{} of {} iterations done.'. format(i + 1, niter))
+
+    return x, dict(speed=speed, speed_efficiency=speed_efficiency, force=old_force)
+
+
+
+def write_positions(posfp, labels, x, iteration=None, speed_state=None):
+    '''
+    Write positions as a json dict label -> [x, y] (the format of fa2 positions dumped with json),
+    replacing the file atomically. Iteration and speed state go to posfp + '.state.npz'.
+    '''
+    tmp = str(posfp) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({str(l): [float(p[0]), float(p[1])] for l, p in zip(labels, x)}, f)
+
+    if iteration is not None:
+        with open(tmp + '.npz', 'wb') as f:
+            np.savez(f, iteration=iteration, **(speed_state or {}))
+        os.replace(tmp + '.npz', str(posfp) + '.state.npz')
+    os.replace(tmp, posfp)
+
+
+
+def read_positions(posfp):
+    '''Positions dict and the saved state (or None) of a positions file.'''
+    with open(posfp, 'r') as f:
+        pos = json.load(f)
+    state = None
+    if Path(str(posfp) + '.state.npz').exists():
+        with np.load(str(posfp) + '.state.npz') as f:
+            state = {k: f[k] if f[k].ndim else f[k].item() for k in f.files}
+    return pos, state
+
+
+
+def warm_start(adjacency, labels, pos, seed=None):
+    '''
+    Initial positions from a previous layout `pos` (dict label -> (x, y)).
+    New nodes are placed at the mean position of their placed neighbours plus a little
+    jitter, or at random within the previous layout if they have none.
+
+    Returns:
+    -------
+    positions array and boolean mask of the nodes that were placed before
+    '''
+    rng = np.random.default_rng(seed)
+    n = len(labels)
+    pos = {str(k): p for k, p in pos.items()}
+    known = np.array([str(l) in pos for l in labels], dtype=bool)
+    x = np.zeros((n, 2))
+    if known.any():
+        x[known] = [pos[str(l)] for l in labels[known]]
+        lo, hi = x[known].min(axis=0), x[known].max(axis=0)
+    else:
+        lo, hi = np.zeros(2), np.ones(2)
+    scale = max((hi - lo).max(), 1e-9)
+
+    a = sparse.csr_matrix(adjacency)
+    a_known = a[:, np.flatnonzero(known)]
+    placed_neighbours = np.diff(a_known.indptr)
+    new = ~known
+    with_neighbours = new & (placed_neighbours > 0)
+    mean = (a_known.astype(bool).astype(np.float64) @ x[known])[with_neighbours] / placed_neighbours[with_neighbours][:, None]
+    x[with_neighbours] = mean + rng.normal(scale=.01 * scale, size=mean.shape)
+    lonely = new & ~with_neighbours
+    x[lonely] = lo + rng.random((lonely.sum(), 2)) * (hi - lo + 1e-9)
+
+    return x, known
+
+
+
+def layout(g, pos=None, niter=100, posfp=None, checkpoint_every=0, resume=False, settle_new_only=False, seed=None, v=False):
+    '''
+    ForceAtlas2 positions of a graph (networkx graph or csrgraph.CSRGraph).
+
+    Args:
+    -----
+    pos: previous positions (dict label -> (x, y)) used as a warm start, new nodes are
+        placed next to their neighbours; with settle_new_only only the new nodes move
+    posfp: positions file, written every `checkpoint_every` iterations and at the end
+    resume: continue from the positions and iteration saved in posfp, if it exists
+
+    Returns:
+    -------
+    dict label -> (x, y), like fa2.ForceAtlas2().forceatlas2_networkx_layout
+    '''
+    g = g if isinstance(g, CSRGraph) else CSRGraph.from_networkx(g)
+    start, speed_state, fixed, x = 0, None, None, None
+
+    if pos is not None:
+        x, known = warm_start(g.adjacency, g.labels, pos, seed=seed)
+        fixed = known if settle_new_only else None
+        v and print('Warm start: {} of {} nodes placed before.'. format(known.sum(), len(known)))
+
+    if resume and posfp and Path(posfp).exists():
+        saved, state = read_positions(posfp)
+        x, _ = warm_start(g.adjacency, g.labels, saved, seed=seed)
+        if state:
+            start = int(state.pop('iteration'))
+            speed_state = state if len(state.get('force', ())) == len(g.labels) else None
+        v and print('Resuming layout from {} at iteration {}.'. format(posfp, start))
+
+    checkpoint = None
+    if posfp:
+        checkpoint = lambda x, i, s: write_positions(posfp, g.labels, x, i, s)
+
+    x, _ = forceatlas2(g.adjacency, pos=x, niter=niter, fixed=fixed, start=start, speed_state=speed_state,
+            checkpoint=checkpoint, checkpoint_every=checkpoint_every, seed=seed, v=v)
+
+    return {l: (p[0], p[1]) for l, p in zip(g.labels, x)}
@@ -1,76 +1,246 @@
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import glob
 import json
 import pandas as pd
+from columnar import write_columns
+from vocab import intern_records, save_vocabs
+from instrument import staged, count, gauge, progress
 
-def parse_tweets(pattern, reldir, root, v=False, fwrite=False, fwritedir=None):
+DATASETS = ('retweets', 'original_tweets', 'data_issue')
+
+
+def parse_tweet(d):
     '''
-    pattern = '*_data_*.json'
-    reldir = 'data/twitterdata/'
-    root = './'
-    fwritedir = 'output/parse/'
+    Parse one tweet object from the API response.
+    Returns the name of the dataset the tweet belongs to ('retweets', 'original_tweets'
+    or 'data_issue') and the record.
+    '''
+    try:
+        tags = [hashtag['tag'] for hashtag in d['entities']['hashtags']]
+    except:
+        tags = []
+
+    try:
+        if len(d['referenced_tweets']) > 0:
+            return 'retweets', {
+                            'created_at': d['created_at'],
+                            'tweet_id': d['id'],
+                            'author_id': d['author_id'],
+                            'referenced_tweet_id': [re['id'] for re in d['referenced_tweets']],
+                            'full_ref_data': d['referenced_tweets'],
+                            'tags': tags
+                            }
+        else:
+            return 'original_tweets', {
+                            'created_at': d['created_at'],
+                            'tweet_id': d['id'],
+                            'author_id': d['author_id'],
+                            'referenced_tweet_id': None,
+                            'tags': tags
+                            }
+    except:
+            return 'data_issue', {
+                            'created_at': d['created_at'],
+                            'tweet_id': d['id'],
+                            'author_id': d['author_id'],
+                            'referenced_tweet_id': 'undefined',
+                            'tags': tags
+                            }
+
+
+
+def iter_json_array(f, chunksize=1 << 20):
+    '''
+    Yields the elements of a top level json array one at a time,
+    reading the file in chunks of `chunksize` characters instead of loading it whole.
+    '''
+    decoder = json.JSONDecoder()
+    buf = f.read(chunksize)
+    eof = not buf
+    pos = 0
+    started = False
+
+    while True:
+        # skip whitespace, and separators between elements
+        skip = ' \t\r\n,' if started else ' \t\r\n'
+        while pos < len(buf) and buf[pos] in skip:
+            pos += 1
+
+        if pos == len(buf):
+            if eof:
+                raise ValueError('Unexpected end of file while reading json array.')
+            buf = f.read(chunksize)
+            eof = not buf
+            pos = 0
+            continue
+
+        if not started:
+            if buf[pos] != '[':
+                raise ValueError('Expected a json array, got {!r}.'. format(buf[pos]))
+            started = True
+            pos += 1
+            continue
+
+        if buf[pos] == ']':
+            return
+
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            obj, end = None, None
+
+        if end is None or (end == len(buf) and not eof):
+            # element is cut by the chunk boundary, read more
+            if eof:
+                raise ValueError('Could not decode json element at position {}.'. format(pos))
+            chunk = f.read(chunksize)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+
+        yield obj
+        pos = end
+
+
+
+def stream_tweets(pattern, reldir, root, batch_size=10000, chunksize=1 << 20, vocabs=None, v=False):
+    '''
+    Streaming version of parse_tweets.
+    Tweets are decoded one at a time within each file and yielded in batches,
+    so memory is bounded by `batch_size` records and `chunksize` characters
+    rather than by the size of the corpus.
+    If `vocabs` (see vocab.make_vocabs) is given, records carry integer codes instead of ids and tags.
+
+    Yields:
+    -------
+    (name, records): name is 'retweets', 'original_tweets' or 'data_issue',
+        records is a list of at most `batch_size` records of that dataset.
+        Remaining records are flushed at the end of the last file.
     '''
 
     imatches = glob.iglob(root + reldir + pattern)
-    retweets = []
-    original_tweets = []
-    data_issue = []
+    batches = {n: [] for n in DATASETS}
     file_count = 0
 
     for match in imatches:
         v and print('... parsing file {}'. format(match))
         with open(match, 'r') as f:
-            data = json.load(f)
-            for d in  data:
-                try:
-                    tags = [hashtag['tag'] for hashtag in d['entities']['hashtags']]
-                except:
-                    tags = []
-
-                try:
-                    if len(d['referenced_tweets']) > 0:
-                        retweets.append({
-                                        'created_at': d['created_at'],
-                                        'tweet_id': d['id'],
-                                        'author_id': d['author_id'],
-                                        'referenced_tweet_id': [re['id'] for re in d['referenced_tweets']],
-                                        'full_ref_data': d['referenced_tweets'],
-                                        'tags': tags 
-                                        })
-                    else:
-                        original_tweets.append({
-                                        'created_at': d['created_at'],
-                                        'tweet_id': d['id'],
-                                        'author_id': d['author_id'],
-                                        'referenced_tweet_id': None,
-                                        'tags': tags 
-                                        })
-                except:
-                        data_issue.append({
-                                        'created_at': d['created_at'],
-                                        'tweet_id': d['id'],
-                                        'author_id': d['author_id'],
-                                        'referenced_tweet_id': 'undefined',
-                                        'tags': tags 
-                                        })
-            file_count += 1
+            for d in iter_json_array(f, chunksize=chunksize):
+                name, record = parse_tweet(d)
+                batches[name].append(record)
+                if len(batches[name]) >= batch_size:
+                    vocabs and intern_records(batches[name], vocabs)
+                    yield name, batches[name]
+                    batches[name] = []
+        file_count += 1
+
+    for name in DATASETS:
+        if batches[name]:
+            vocabs and intern_records(batches[name], vocabs)
+            yield name, batches[name]
+
+    v and print('***\n {} files parsed.\n***'. format(file_count))
+
+
+
+def parse_file(fp):
+    '''
+    Parse one data file.
+    Returns a dict with the 'retweets', 'original_tweets' and 'data_issue' records of the file.
+    '''
+    parsed = {n: [] for n in DATASETS}
+
+    with open(fp, 'r') as f:
+        data = json.load(f)
+        for d in  data:
+            name, record = parse_tweet(d)
+            parsed[name].append(record)
+
+    return parsed
+
+
+
+@staged
+def parse_files(matches, workers=None, vocabs=None, v=False):
+    '''
+    Parse a list of data files, in a process pool of `workers` processes if workers > 1.
+    Returns a dict with the 'retweets', 'original_tweets' and 'data_issue' records of all files,
+    in the order of matches. See parse_tweets for vocabs.
+    '''
+    parsed = {n: [] for n in DATASETS}
+
+    if workers and workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        # map yields results in the order of matches
+        results = executor.map(parse_file, matches, chunksize=max(1, len(matches) // (workers * 4)))
+    else:
+        executor = None
+        results = map(parse_file, matches)
+
+    try:
+        for match, result in progress(zip(matches, results), total=len(matches), desc='parsing files'):
+            v and print('... parsed file {}'. format(match))
+            count('files_parsed')
+            for n in DATASETS:
+                count(n, len(result[n]))
+                vocabs and intern_records(result[n], vocabs)
+                parsed[n].extend(result[n])
+    finally:
+        executor and executor.shutdown()
+
+    return parsed
+
+
+
+@staged
+def parse_tweets(pattern, reldir, root, v=False, fwrite=False, fwritedir=None, workers=None, fformat='json', vocabs=None):
+    '''
+    pattern = '*_data_*.json'
+    reldir = 'data/twitterdata/'
+    root = './'
+    fwritedir = 'output/parse/'
+    fformat = 'json' writes one json file per dataset, 'columnar' writes one directory
+        per dataset in the memory mappable format of columnar.py
+    workers = number of processes the files are parsed in, None or 1 parses serially.
+        Results are merged in file order, so the output is the same as the serial run.
+    vocabs = dict of vocab.Vocabulary (see vocab.make_vocabs). If given, tweet ids, author ids,
+        referenced ids and tags are replaced by integer codes, and the vocabularies are
+        written next to the datasets when fwrite.
+    '''
+
+    matches = list(glob.iglob(root + reldir + pattern))
+    parsed = parse_files(matches, workers=workers, vocabs=vocabs, v=v)
+    file_count = len(matches)
+    gauge('files_parsed', file_count)
 
     v and print('***\n {} files parsed.\n***'. format(file_count))
 
+    retweets, original_tweets, data_issue = (parsed[n] for n in DATASETS)
+
     if fwrite:
         Path(root + fwritedir).mkdir(parents=True, exist_ok=True)
 
         datasets = [retweets, original_tweets, data_issue]
         names = ['retweets', 'original_tweets', 'data_issue']
-        
+
         for n, d in zip(names, datasets):
+            if fformat == 'columnar':
+                write_columns(d, root + fwritedir + n, interned=bool(vocabs), v=v)
+                continue
+
             fname = n + '.json'
-            
+
             with open(root + fwritedir + fname, 'w') as f:
                 json.dump(d, f)
 
             v and print('wrote file {}'. format(root + fwritedir + fname))
 
+        if vocabs:
+            save_vocabs(vocabs, root + fwritedir)
+            v and print('wrote vocabularies to {}'. format(root + fwritedir))
+
         return
 
 
@@ -0,0 +1,113 @@
+'''
+Shortest path statistics of large connected graphs.
+
+Single source shortest paths (Dijkstra, or BFS for unweighted graphs) are run from
+batches of source nodes with scipy.sparse.csgraph, in a process pool if workers > 1.
+Every source contributes its mean distance to all other nodes, its eccentricity and a
+histogram of its distances, so memory is bounded by batch_size x number of nodes.
+With all nodes as sources the mean is the exact average shortest path length
+(nx.average_shortest_path_length), with a sample of sources it is an estimate with
+a standard error.
+'''
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+_adjacency = None
+
+
+def _init_worker(adjacency):
+    global _adjacency
+    _adjacency = adjacency
+
+
+
+def _source_batch(sources, weighted, bin_width):
+    '''Mean distance and eccentricity of every source, and the histogram of all distances.'''
+    dist = csgraph.dijkstra(_adjacency, directed=False, indices=sources, unweighted=not weighted)
+    n = dist.shape[1]
+    means = dist.sum(axis=1) / (n - 1)
+    eccentricity = dist.max(axis=1)
+    d = dist[dist > 0]
+    histogram = np.bincount(np.floor(d[np.isfinite(d)] / bin_width).astype(np.int64))
+    return means, eccentricity, histogram
+
+
+
+def _merge_histograms(histograms):
+    out = np.zeros(max((len(h) for h in histograms), default=0), dtype=np.int64)
+    for h in histograms:
+        out[:len(h)] += h
+    return out
+
+
+
+def path_stats(adjacency, n_sources=None, weighted=True, workers=None, batch_size=None, bin_width=1, seed=None, v=False):
+    '''
+    Average shortest path length, path length distribution and diameter estimate.
+
+    Args:
+    -----
+    adjacency: symmetric scipy.sparse matrix (e.g. CSRGraph.adjacency) of a connected graph,
+        weights are used as distances if weighted
+    n_sources: number of sampled source nodes, None for all nodes (exact)
+    workers: number of processes, None or 1 runs in this process
+    batch_size: sources per Dijkstra call, by default as many as fit in ~128MB of distances
+    bin_width: width of the path length histogram bins
+
+    Returns:
+    -------
+    dict with
+        mean: (estimated) average shortest path length
+        sem: standard error of the mean (0 if exact)
+        ci95: 95% confidence interval of the mean
+        diameter: largest distance found (the diameter if exact, a lower bound if sampled)
+        histogram: number of (ordered) node pairs per distance bin, bin i is [i*bin_width, (i+1)*bin_width)
+        n_sources, exact
+    '''
+    adjacency = sparse.csr_matrix(adjacency)
+    n = adjacency.shape[0]
+    if n < 2:
+        raise ValueError('Path statistics need at least two nodes.')
+    if csgraph.connected_components(adjacency, directed=False)[0] > 1:
+        raise ValueError('Graph is not connected.')
+
+    exact = n_sources is None or n_sources >= n
+    if exact:
+        sources = np.arange(n)
+    else:
+        sources = np.sort(np.random.default_rng(seed).choice(n, size=n_sources, replace=False))
+
+    batch_size = batch_size or max(1, min(256, (1 << 24) // n))
+    batches = [sources[i:i+batch_size] for i in range(0, len(sources), batch_size)]
+    v and print('Shortest paths from {} of {} nodes in {} batches.'. format(len(sources), n, len(batches)))
+
+    if workers and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(adjacency,)) as executor:
+            results = list(executor.map(_source_batch, batches, [weighted] * len(batches), [bin_width] * len(batches)))
+    else:
+        _init_worker(adjacency)
+        results = [_source_batch(b, weighted, bin_width) for b in batches]
+
+    means = np.concatenate([r[0] for r in results])
+    eccentricity = np.concatenate([r[1] for r in results])
+    mean = means.mean()
+
+    if exact or len(means) < 2:
+        sem = 0.
+    else:
+        # sampling without replacement from a finite population of sources
+        sem = means.std(ddof=1) / np.sqrt(len(means)) * np.sqrt(1 - len(means) / n)
+
+    stats = dict(
+            mean=mean,
+            sem=sem,
+            ci95=(mean - 1.96 * sem, mean + 1.96 * sem),
+            diameter=eccentricity.max(),
+            histogram=_merge_histograms([r[2] for r in results]),
+            n_sources=len(sources),
+            exact=exact)
+    v and print('Average shortest path length {:.4f} +- {:.4f}, diameter {} {}.'. format(mean, 1.96 * sem, 'is' if exact else '>=', stats['diameter']))
+
+    return stats
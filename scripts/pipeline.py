@@ -0,0 +1,261 @@
+'''
+Command line pipeline: parse -> edgelists -> components -> statistics / figures.
+
+Stages are declared with their dependencies, parameters and the modules they run.
+Each stage writes its outputs to cachedir/<stage>/<key>/, where key is a hash of the
+stage parameters, the source code of its modules, the keys of the stages it depends on
+and, for the parse stage, the path, size and modification time of every data file.
+A stage whose key already has complete outputs is not run again, so changing e.g. a plot
+option only re-runs the stages that depend on it. Stages whose dependencies are done run
+concurrently in a process pool (the retweet and hashtag branches, statistics and figures).
+The windows stage writes the edgelists and summaries of the networks of every time window
+(see temporal.py).
+With --memory-budget the edgelists are aggregated out of core in hash partitioned shards.
+The figures stage checkpoints its layouts next to its output directory, so an
+interrupted layout resumes from the last checkpoint when the stage is run again.
+With --metrics, the timings, peak memory and counters of every stage and of the functions
+it runs (see instrument.py) are appended to a json lines file.
+
+usage: python pipeline.py --root ./ --reldir data/twitterdata/ --outdir output/ -v
+'''
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import matplotlib
+matplotlib.use('Agg')
+import pandas as pd
+
+SCRIPTS = Path(__file__).resolve().parent
+
+
+def run_tweets(inputs, params, outdir):
+    from parse import parse_files
+    from build_net import format_tweets
+    parsed = parse_files(sorted(glob.glob(params['root'] + params['reldir'] + params['pattern'])), workers=params['workers'])
+    tweetsdf, retweetsdf = format_tweets(parsed['original_tweets'], parsed['retweets'], table=True, v=False)
+    pd.to_pickle(tweetsdf, outdir / 'tweets.pkl')
+    pd.to_pickle(retweetsdf, outdir / 'retweets.pkl')
+    with open(outdir / 'data_issue.json', 'w') as f:
+        json.dump(parsed['data_issue'], f)
+
+
+
+def run_rt_edgelist(inputs, params, outdir):
+    from build_net import rt_source_to_target, write_edgelist
+    tweetsdf = pd.read_pickle(inputs['tweets'] / 'tweets.pkl')
+    retweetsdf = pd.read_pickle(inputs['tweets'] / 'retweets.pkl')
+    if params['memory_budget']:
+        from shards import rt_connection_chunks, write_edgelist_external
+        summary = write_edgelist_external(rt_connection_chunks(tweetsdf, retweetsdf), outdir / 'rt_edgelist.txt', outdir / 'shards',
+                memory_budget=params['memory_budget'], workers=params['workers'], sort=True)
+        with open(outdir / 'rt_summary.json', 'w') as f:
+            json.dump(summary, f)
+        return
+    connectionlist, data_issues, non_match_tracker = rt_source_to_target(tweetsdf, retweetsdf)
+    write_edgelist(connectionlist, outdir / 'rt_edgelist.txt', v=False)
+    with open(outdir / 'rt_summary.json', 'w') as f:
+        json.dump(dict(connections=len(connectionlist), data_issues=len(data_issues), non_matches=non_match_tracker), f)
+
+
+
+def run_ht_edgelist(inputs, params, outdir):
+    from build_net import process_hashtags, ht_source_to_target, write_edgelist
+    tweetsdf = pd.read_pickle(inputs['tweets'] / 'tweets.pkl')
+    hashtags, tag_counts = process_hashtags(tweetsdf, tagusefp=outdir / 'tag_use.png', tagspertweetfp=outdir / 'tags_per_tweet.png', v=False)
+    if params['memory_budget']:
+        from shards import ht_connection_chunks, write_edgelist_external
+        write_edgelist_external(ht_connection_chunks(tweetsdf), outdir / 'ht_edgelist.txt', outdir / 'shards',
+                memory_budget=params['memory_budget'], workers=params['workers'], sort=True)
+        return
+    write_edgelist(ht_source_to_target(hashtags, method=params['ht_method']), outdir / 'ht_edgelist.txt', v=False)
+
+
+
+def run_windows(inputs, params, outdir):
+    from temporal import temporal_networks
+    tweets = pd.read_pickle(inputs['tweets'] / 'tweets.pkl')
+    retweets = pd.read_pickle(inputs['tweets'] / 'retweets.pkl')
+    temporal_networks(tweets, retweets, size=params['window'], step=params['window_step'], outdir=outdir, summaryfp=outdir / 'windows.json')
+
+
+
+def run_components(inputs, params, outdir):
+    from vis import parse_net_components
+    graphs = parse_net_components(inputs['rt_edgelist'] / 'rt_edgelist.txt', inputs['ht_edgelist'] / 'ht_edgelist.txt',
+            figfp=outdir / 'components.png', backend='csr', v=False)
+    for name, g in graphs.items():
+        g.save(outdir / (name + '.npz'))
+
+
+
+def run_stats(inputs, params, outdir):
+    from csrgraph import CSRGraph
+    from vis import vis_net_stats
+    g = {name: CSRGraph.load(inputs['components'] / (name + '.npz')) for name in ('rt_h', 'ht_h')}
+    data = vis_net_stats(g['rt_h'], g['ht_h'], compute_paths=params['path_sources'] is not None, path_sources=params['path_sources'] or None,
+            seed=params['seed'], overviewfp=outdir / 'overview.png', clusteringfp=outdir / 'clustering.png', v=False)
+    paths = {k: {s: (v.tolist() if hasattr(v, 'tolist') else v) for s, v in p.items()} for k, p in data.items() if k.endswith('_paths')}
+    with open(outdir / 'paths.json', 'w') as f:
+        json.dump(paths, f)
+
+
+
+def run_figures(inputs, params, outdir):
+    from csrgraph import CSRGraph
+    from vis import vis_net
+    # layout checkpoints of this key outside of the .tmp directory, which is emptied when the stage is re-run
+    checkpoints = outdir.with_suffix('.checkpoints')
+    checkpoints.mkdir(exist_ok=True)
+    for name, title in (('rt_h', 'Retweet network'), ('ht_h', 'Hashtag network')):
+        g = CSRGraph.load(inputs['components'] / (name + '.npz'))
+        posfp = checkpoints / (name + '_pos.json')
+        vis_net(g, recomputepos=True, niter=params['niter'], posfp=posfp, engine='numpy', checkpoint_every=params.get('checkpoint_every') or 0,
+                resume=True, visnetfp=outdir / (name + '.png'), title=title, renderer='fast', edge_quantile=params['edge_quantile'])
+        shutil.copy(posfp, outdir / (name + '_pos.json'))
+    shutil.rmtree(checkpoints)
+
+
+
+# name: (function, dependencies, parameter names, modules)
+STAGES = {
+    'tweets': (run_tweets, (), ('root', 'reldir', 'pattern'), ('parse', 'build_net', 'columnar', 'vocab')),
+    'rt_edgelist': (run_rt_edgelist, ('tweets',), ('memory_budget',), ('build_net', 'shards')),
+    'ht_edgelist': (run_ht_edgelist, ('tweets',), ('ht_method', 'memory_budget'), ('build_net', 'tagstats', 'shards')),
+    'windows': (run_windows, ('tweets',), ('window', 'window_step'), ('temporal', 'build_net', 'csrgraph')),
+    'components': (run_components, ('rt_edgelist', 'ht_edgelist'), (), ('vis', 'csrgraph')),
+    'stats': (run_stats, ('components',), ('path_sources', 'seed'), ('vis', 'csrgraph', 'paths')),
+    'figures': (run_figures, ('components',), ('niter', 'edge_quantile'), ('vis', 'csrgraph', 'layout')),
+}
+
+
+
+def _data_fingerprint(params):
+    '''Path, size and modification time of every data file.'''
+    files = sorted(glob.glob(params['root'] + params['reldir'] + params['pattern']))
+    return [(f, os.stat(f).st_size, os.stat(f).st_mtime_ns) for f in files]
+
+
+
+def stage_keys(params):
+    '''Cache key of every stage.'''
+    keys = {}
+    for name, (func, deps, param_names, modules) in STAGES.items():
+        h = hashlib.sha256()
+        h.update(name.encode())
+        h.update(json.dumps({p: params[p] for p in param_names}, sort_keys=True).encode())
+        for module in modules:
+            h.update((SCRIPTS / (module + '.py')).read_bytes())
+        for dep in deps:
+            h.update(keys[dep].encode())
+        if name == 'tweets':
+            h.update(json.dumps(_data_fingerprint(params)).encode())
+        keys[name] = h.hexdigest()[:16]
+    return keys
+
+
+
+def _run_stage(name, inputs, params, outdir):
+    '''Run a stage into a temporary directory and move it into place when complete.'''
+    tmp = Path(str(outdir) + '.tmp')
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    import instrument
+    instrument.configure(sink=params.get('metrics'), stage_peaks=True)
+    with instrument.stage(name, key=outdir.name):
+        STAGES[name][0](inputs, params, tmp)
+    shutil.rmtree(outdir, ignore_errors=True)
+    os.replace(tmp, outdir)
+    return name
+
+
+
+def run(params, targets=None, force=(), workers=2, v=False):
+    '''
+    Run the stages needed for `targets` (all stages by default), re-running stages in `force`.
+    Returns dict stage -> output directory.
+    '''
+    keys = stage_keys(params)
+    cachedir = Path(params['cachedir'])
+    outdirs = {name: cachedir / name / keys[name] for name in STAGES}
+
+    # stages needed for the targets
+    needed, todo = set(), list(targets or STAGES)
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(STAGES[name][1])
+
+    done = {name for name in needed if outdirs[name].is_dir() and name not in force}
+    for name in sorted(done):
+        v and print('{}: cached in {}'. format(name, outdirs[name]))
+
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while needed - done:
+            for name in STAGES:
+                ready = name in needed and name not in done and name not in running.values() and all(d in done for d in STAGES[name][1])
+                if ready:
+                    v and print('{}: running'. format(name))
+                    inputs = {d: outdirs[d] for d in STAGES[name][1]}
+                    running[executor.submit(_run_stage, name, inputs, params, outdirs[name])] = name
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                future.result()
+                done.add(name)
+                v and print('{}: done, outputs in {}'. format(name, outdirs[name]))
+
+    return {name: outdirs[name] for name in needed}
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build and visualise the retweet and hashtag networks with cached stages.')
+    parser.add_argument('--root', default='./')
+    parser.add_argument('--reldir', default='data/twitterdata/')
+    parser.add_argument('--pattern', default='*_data_*.json')
+    parser.add_argument('--cachedir', default='output/cache/')
+    parser.add_argument('--outdir', default=None, help='copy the outputs of the run stages here')
+    parser.add_argument('--workers', type=int, default=None, help='processes for parsing')
+    parser.add_argument('--jobs', type=int, default=2, help='stages run concurrently')
+    parser.add_argument('--ht-method', default='sparse', choices=('sparse', 'combinations'))
+    parser.add_argument('--memory-budget', type=float, default=None,
+            help='GB for building the edgelists out of core (see shards.py), in memory if not given')
+    parser.add_argument('--path-sources', type=int, default=None, help='sampled sources for path statistics, not computed if not given')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the sampled path sources')
+    parser.add_argument('--niter', type=int, default=100, help='layout iterations')
+    parser.add_argument('--checkpoint-every', type=int, default=10, help='layout iterations between checkpoints, an interrupted layout resumes from the last one')
+    parser.add_argument('--edge-quantile', type=float, default=0.)
+    parser.add_argument('--window', default='1D', help='length of the time windows of the windows stage, e.g. 1h, 1D')
+    parser.add_argument('--window-step', default=None, help='start of one window to the next, by default the window length')
+    parser.add_argument('--stages', nargs='*', choices=list(STAGES), help='target stages, all by default')
+    parser.add_argument('--force', nargs='*', default=(), choices=list(STAGES), help='re-run these stages')
+    parser.add_argument('--metrics', default=None, help='json lines file the stage metrics are appended to')
+    parser.add_argument('-v', action='store_true')
+    args = parser.parse_args(argv)
+
+    params = dict(root=args.root, reldir=args.reldir, pattern=args.pattern, cachedir=args.cachedir, workers=args.workers,
+            ht_method=args.ht_method, path_sources=args.path_sources, seed=args.seed, niter=args.niter, checkpoint_every=args.checkpoint_every,
+            edge_quantile=args.edge_quantile,
+            window=args.window, window_step=args.window_step,
+            memory_budget=args.memory_budget and int(args.memory_budget * 2 ** 30),
+            metrics=args.metrics and str(Path(args.metrics).resolve()))
+    if args.metrics:
+        Path(args.metrics).parent.mkdir(parents=True, exist_ok=True)
+    outdirs = run(params, targets=args.stages, force=args.force, workers=args.jobs, v=args.v)
+
+    if args.outdir:
+        for name, d in outdirs.items():
+            shutil.copytree(d, Path(args.outdir) / name, dirs_exist_ok=True)
+        args.v and print('Outputs copied to {}'. format(args.outdir))
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+'''
+External memory edge aggregation for networks whose connections do not fit in memory.
+
+Connections are added in chunks as they are produced (e.g. per batch of retweets or
+tweets, see rt_connection_chunks and ht_connection_chunks). Every (source, target) pair
+is canonicalized to (min, max) and hash-partitioned on the pair into one of n_shards
+files; pairs are buffered in memory and appended to the shard files, aggregated to
+weighted pairs, whenever the buffer reaches its share of the memory budget. Each shard
+holds all occurrences of its edges, so the shards are reduced to weighted edges
+independently, in a process pool. A shard too large for the budget of one worker is
+first split again, one appended chunk at a time, with a hash salted by the split level.
+The reduced shards are concatenated into the edgelist (or merged in the sorted order of
+build_net.write_edgelist with sort=True).
+
+usage:
+    shards = EdgeShards('output/shards/rt/', memory_budget=2 * 2 ** 30)
+    for chunk in rt_connection_chunks(tweets, retweets):
+        shards.add(chunk['source'], chunk['target'])
+    shards.write_edgelist('output/rt_edgelist.txt', workers=4)
+'''
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import heapq
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from build_net import aggregate_edges, id_index, resolve_references, tag_pairs
+from instrument import staged, gauge, progress
+
+# rough in-memory bytes per buffered (lo, hi, weight) triple
+BYTES_PER_EDGE = dict(int=24, object=160)
+
+
+def _salt(level):
+    '''splitmix64 of the re-split level.'''
+    mask = 2 ** 64 - 1
+    z = level * 0x9E3779B97F4A7C15 & mask
+    z = (z ^ z >> 30) * 0xBF58476D1CE4E5B9 & mask
+    z = (z ^ z >> 27) * 0x94D049BB133111EB & mask
+    return np.uint64(z ^ z >> 31)
+
+
+
+def _shard_of(lo, hi, n_shards, level=0):
+    '''Shard number of every canonical pair, `level` salts the hash for re-splitting shards.'''
+    h = pd.util.hash_array(np.asarray(lo)) * np.uint64(31) + pd.util.hash_array(np.asarray(hi))
+    if level:
+        # hash_key only salts object arrays, so the level is mixed into the pair hash itself
+        h = pd.util.hash_array(h ^ _salt(level))
+    return (h % np.uint64(n_shards)).astype(np.int64)
+
+
+
+def _aggregate(lo, hi, weight):
+    '''Weighted unique (lo, hi) pairs of canonical pairs, sorted, self-loops included.'''
+    codes, nodes = pd.factorize(np.concatenate([lo, hi]), sort=True)
+    lo_codes, hi_codes, weight = aggregate_edges(codes[:len(lo)], codes[len(lo):], weights=weight)
+    nodes = np.asarray(nodes)
+    return nodes[lo_codes], nodes[hi_codes], weight
+
+
+
+def _append(fp, lo, hi, weight):
+    with open(fp, 'ab') as f:
+        for a in (lo, hi, weight):
+            np.save(f, a, allow_pickle=True)
+
+
+
+def _blocks(fp):
+    '''The (lo, hi, weight) chunks appended to a shard file, one at a time.'''
+    size = os.path.getsize(fp)
+    with open(fp, 'rb') as f:
+        while f.tell() < size:
+            yield tuple(np.load(f, allow_pickle=True) for _ in range(3))
+
+
+
+def _read(fp):
+    '''All (lo, hi, weight) chunks appended to a shard file, concatenated.'''
+    return tuple(np.concatenate(p) for p in zip(*_blocks(fp)))
+
+
+
+def _reduce_shard(fp, outfp):
+    '''Weighted edges of one shard, sorted, self-loops dropped, written as edgelist lines.'''
+    lo, hi, weight = _aggregate(*_read(fp))
+    self_loops = lo == hi
+    edges = pd.DataFrame({'source': lo[~self_loops], 'target': hi[~self_loops], 'weight': weight[~self_loops]})
+    edges.to_csv(outfp, sep=' ', header=False, index=False)
+    return len(edges), int(self_loops.sum()), int(weight.sum())
+
+
+
+class EdgeShards:
+    '''
+    Hash partitioned on-disk store of (source, target, weight) connections.
+
+    dirpath: directory of the shard files (emptied first)
+    n_shards: number of partitions
+    memory_budget: bytes for buffered pairs while adding, and for all reducing workers together
+    '''
+
+    def __init__(self, dirpath, n_shards=64, memory_budget=2 ** 30):
+        self.dirpath = Path(dirpath)
+        shutil.rmtree(self.dirpath, ignore_errors=True)
+        self.dirpath.mkdir(parents=True)
+        self.n_shards = n_shards
+        self.memory_budget = memory_budget
+        self.buffers = [[] for _ in range(n_shards)]
+        self.buffered = 0
+        self.connections = 0
+        self.kind = None
+
+    def __repr__(self):
+        return 'EdgeShards with {} connections in {} shards in {}'. format(self.connections, self.n_shards, self.dirpath)
+
+    def shard_path(self, i):
+        return self.dirpath / 'shard_{}.npy'. format(i)
+
+    def add(self, sources, targets, weights=None):
+        '''Add connections (node labels or codes), each counting weight (default 1) times.'''
+        sources, targets = np.asarray(sources), np.asarray(targets)
+        weights = np.ones(len(sources), dtype=np.int64) if weights is None else np.asarray(weights)
+        if not len(sources):
+            return
+        self.kind = self.kind or ('int' if sources.dtype.kind in 'iu' else 'object')
+
+        # canonical undirected pairs
+        swap = sources > targets
+        lo, hi = np.where(swap, targets, sources), np.where(swap, sources, targets)
+        shard = _shard_of(lo, hi, self.n_shards)
+        order = np.argsort(shard, kind='stable')
+        bounds = np.searchsorted(shard[order], np.arange(self.n_shards + 1))
+        for i in np.flatnonzero(np.diff(bounds)):
+            rows = order[bounds[i]:bounds[i+1]]
+            self.buffers[i].append((lo[rows], hi[rows], weights[rows]))
+
+        self.buffered += len(sources)
+        self.connections += len(sources)
+        # half of the budget for buffers, the rest for the chunk being added
+        if self.buffered * BYTES_PER_EDGE[self.kind] > self.memory_budget // 2:
+            self.flush()
+
+    def flush(self):
+        '''Append all buffered pairs to their shard files, aggregated to weighted pairs.'''
+        for i, buffer in enumerate(self.buffers):
+            if buffer:
+                _append(self.shard_path(i), *_aggregate(*(np.concatenate(a) for a in zip(*buffer))))
+            self.buffers[i] = []
+        self.buffered = 0
+
+    def _split(self, fp, level, limit):
+        '''
+        Shard files of at most ~limit bytes: fp as it is, or re-partitioned block by block
+        with the hash of `level`.
+        '''
+        if os.path.getsize(fp) * 3 <= limit or level > 8:
+            return [fp]
+        n = int(np.ceil(os.path.getsize(fp) * 3 / limit)) + 1
+        parts = [Path('{}.{}.{}'. format(fp, level, i)) for i in range(n)]
+        for lo, hi, weight in _blocks(fp):
+            shard = _shard_of(lo, hi, n, level=level)
+            order = np.argsort(shard, kind='stable')
+            bounds = np.searchsorted(shard[order], np.arange(n + 1))
+            for i in np.flatnonzero(np.diff(bounds)):
+                rows = order[bounds[i]:bounds[i+1]]
+                _append(parts[i], lo[rows], hi[rows], weight[rows])
+        os.remove(fp)
+        parts = [part for part in parts if part.exists()]
+        # all rows in one part: a single pair that no hash splits
+        if len(parts) == 1:
+            return parts
+        return [p for part in parts for p in self._split(part, level + 1, limit)]
+
+    @staged
+    def reduce(self, workers=None, v=False):
+        '''
+        Reduce every shard to its weighted edges, in `workers` processes if workers > 1.
+        Returns the reduced shard files (sorted edgelists).
+        '''
+        self.flush()
+        workers = workers or 1
+        limit = self.memory_budget // workers
+        shards = [fp for i in range(self.n_shards) if self.shard_path(i).exists() for fp in self._split(self.shard_path(i), 1, limit)]
+        outfps = [Path(str(fp) + '.edges') for fp in shards]
+        v and print('Reducing {} connections in {} shards.'. format(self.connections, len(shards)))
+
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(progress(executor.map(_reduce_shard, shards, outfps), total=len(shards), desc='shards'))
+        else:
+            results = [_reduce_shard(fp, outfp) for fp, outfp in progress(zip(shards, outfps), total=len(shards), desc='shards')]
+
+        edges, self_loops, connections = (sum(r[i] for r in results) for i in range(3))
+        gauge('connections', connections)
+        gauge('unique_edges', edges + self_loops)
+        gauge('self_loops', self_loops)
+        gauge('shards', len(shards))
+        v and print('{} unique connections, {} self-references (not in the edgelist), {} links.'. format(edges + self_loops, self_loops, edges))
+        self.summary = dict(connections=connections, unique_edges=edges + self_loops, self_loops=self_loops, edges=edges, shards=len(shards))
+        return outfps
+
+    def write_edgelist(self, filepath, workers=None, sort=False, nodetype=str, v=False):
+        '''
+        Reduce the shards and write the edgelist to filepath. Edges are concatenated shard by
+        shard, or with sort=True merged into the (source, target) order of build_net.write_edgelist
+        (nodetype: type of the node labels, for their order). Returns a summary dict of the counts.
+        '''
+        outfps = self.reduce(workers=workers, v=v)
+
+        with open(filepath, 'w') as f:
+            if sort:
+                files = [open(fp) for fp in outfps]
+                key = lambda line: tuple(nodetype(x) for x in line.split(' ', 2)[:2])
+                try:
+                    f.writelines(heapq.merge(*files, key=key))
+                finally:
+                    for g in files:
+                        g.close()
+            else:
+                for fp in outfps:
+                    with open(fp) as g:
+                        shutil.copyfileobj(g, f)
+        v and print('-----\nEdgelist written to file {}.'. format(filepath))
+
+        shutil.rmtree(self.dirpath, ignore_errors=True)
+        return self.summary
+
+
+
+def rt_connection_chunks(tweets, retweets, chunksize=1000000):
+    '''
+    Retweet connections of columnar.TweetTables, chunksize retweets at a time.
+    Yields dicts of source and target labels, the connections rt_source_to_target finds.
+    The tweet ids are sorted once for all chunks.
+    '''
+    index = id_index(tweets)
+    for start in range(0, len(retweets), chunksize):
+        chunk = retweets.take(np.arange(start, min(start + chunksize, len(retweets))))
+        rows, refs, matches, sources = resolve_references(tweets, chunk, index=index)
+        single = matches == 1
+        yield dict(source=tweets.labels(sources[single]), target=chunk.labels(np.asarray(chunk['author_id'])[rows[single]]))
+
+
+
+def ht_connection_chunks(tweets, chunksize=1000000):
+    '''
+    Hashtag connections (tag pairs of tweets with multiple tags) of a columnar.TweetTable,
+    chunksize tweets at a time. Yields dicts of source and target labels.
+    '''
+    for start in range(0, len(tweets), chunksize):
+        chunk = tweets.take(np.arange(start, min(start + chunksize, len(tweets))))
+        _, a, b = tag_pairs(chunk['tags'])
+        yield dict(source=tweets.tag_labels(a), target=tweets.tag_labels(b))
+
+
+
+@staged
+def write_edgelist_external(chunks, filepath, shardir, n_shards=64, memory_budget=2 ** 30, workers=None, sort=False, nodetype=str, v=False):
+    '''
+    build_net.write_edgelist for connections that do not fit in memory.
+    chunks: iterable of connection chunks (dicts / data frames with source, target and
+        optionally weight), e.g. rt_connection_chunks or ht_connection_chunks
+    shardir: directory for the temporary shard files
+    See EdgeShards for n_shards, memory_budget and EdgeShards.write_edgelist for sort and nodetype.
+
+    Returns:
+    -------
+    dict with the number of connections, unique edges, self-loops, edges written and shards
+    '''
+    shards = EdgeShards(shardir, n_shards=n_shards, memory_budget=memory_budget)
+    for chunk in chunks:
+        shards.add(chunk['source'], chunk['target'], chunk['weight'] if 'weight' in chunk else None)
+    v and print(shards)
+    return shards.write_edgelist(filepath, workers=workers, sort=sort, nodetype=nodetype, v=v)
@@ -0,0 +1,120 @@
+'''
+Synthetic Twitter API v2 corpus in the layout parse.parse_tweets reads.
+
+Writes `n_files` json files named <prefix>_data_<i>.json, each an array of tweet objects
+with id, author_id, created_at, entities.hashtags and referenced_tweets. Author activity
+and hashtag popularity are Zipf distributed, retweets point mostly to popular earlier
+tweets, a fraction of tweets references several tweets at once, and a few tweets
+reference tweets outside the corpus or lack the referenced_tweets field (data issues).
+
+usage: python synth.py --tweets 100000 --outdir data/synth/
+'''
+from datetime import datetime, timedelta
+from pathlib import Path
+import argparse
+import json
+import numpy as np
+
+FIRST_ID = 1360000000000000000
+REF_TYPES = np.array(['retweeted', 'quoted', 'replied_to'])
+
+
+def _zipf_codes(rng, size, n, a):
+    '''Codes 0..n-1 with Zipf(a) popularity (code 0 most popular).'''
+    return np.minimum(rng.zipf(a, size=size), n) - 1
+
+
+
+def generate(n_tweets, outdir, n_files=10, prefix='synth', n_authors=None, n_tags=None, retweet_frac=.6,
+        multi_ref_frac=.02, missing_ref_frac=.05, undefined_frac=.01, author_exponent=1.6, tag_exponent=1.4,
+        mean_tags=1.2, start='2021-03-01T00:00:00', seconds_per_tweet=1., seed=0, v=False):
+    '''
+    Generate and write the corpus.
+
+    Args:
+    -----
+    n_tweets: number of tweet objects
+    n_authors, n_tags: vocabulary sizes, by default n_tweets // 10 and n_tweets // 20
+    retweet_frac: fraction of tweets referencing other tweets
+    multi_ref_frac: fraction of those referencing two or three tweets
+    missing_ref_frac: fraction of references to tweets not in the corpus
+    undefined_frac: fraction of tweets without referenced_tweets (parsed as data issues)
+    mean_tags: mean number of hashtags per tweet (Poisson)
+
+    Returns:
+    -------
+    list of written file paths
+    '''
+    rng = np.random.default_rng(seed)
+    n_authors = n_authors or max(n_tweets // 10, 2)
+    n_tags = n_tags or max(n_tweets // 20, 2)
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    ids = FIRST_ID + np.arange(n_tweets, dtype=np.int64) * 7
+    authors = rng.permutation(n_authors)[_zipf_codes(rng, n_tweets, n_authors, author_exponent)] + 10 ** 9
+    t0 = datetime.fromisoformat(start)
+    seconds = np.sort(rng.random(n_tweets)) * n_tweets * seconds_per_tweet
+    tag_counts = rng.poisson(mean_tags, size=n_tweets)
+    tags = _zipf_codes(rng, tag_counts.sum(), n_tags, tag_exponent)
+    tag_offsets = np.concatenate([[0], np.cumsum(tag_counts)])
+
+    kind = rng.random(n_tweets)
+    is_ref = kind < retweet_frac
+    undefined = (kind >= retweet_frac) & (kind < retweet_frac + undefined_frac)
+    n_refs = np.where(is_ref, 1 + (rng.random(n_tweets) < multi_ref_frac) * rng.integers(1, 3, size=n_tweets), 0)
+
+    # references point to earlier original tweets, recent and popular ones more often
+    owner = np.repeat(np.arange(n_tweets), n_refs)
+    originals = np.flatnonzero(~is_ref & ~undefined)
+    earlier = np.searchsorted(originals, owner)
+    back = np.minimum(_zipf_codes(rng, len(owner), n_tweets, 1.2), np.maximum(earlier - 1, 0))
+    ref_ids = ids[originals[np.maximum(earlier - 1 - back, 0)]] if len(originals) else np.zeros(len(owner), dtype=np.int64)
+    # tweets outside the corpus
+    missing = (earlier == 0) | (rng.random(len(owner)) < missing_ref_frac)
+    ref_ids = np.where(missing, ref_ids + 3, ref_ids)
+    ref_types = REF_TYPES[rng.choice(len(REF_TYPES), size=len(owner), p=[.8, .1, .1])]
+    ref_offsets = np.concatenate([[0], np.cumsum(n_refs)])
+
+    paths = []
+    for f, rows in enumerate(np.array_split(np.arange(n_tweets), n_files)):
+        data = []
+        for i in rows:
+            d = dict(
+                    id=str(ids[i]),
+                    author_id=str(authors[i]),
+                    created_at=(t0 + timedelta(seconds=float(seconds[i]))).isoformat(timespec='milliseconds') + 'Z',
+                    text='synthetic tweet {}'. format(i))
+            if tag_counts[i]:
+                d['entities'] = dict(hashtags=[dict(start=0, end=0, tag='tag{}'. format(t)) for t in tags[tag_offsets[i]:tag_offsets[i+1]]])
+            if n_refs[i]:
+                refs = slice(ref_offsets[i], ref_offsets[i+1])
+                d['referenced_tweets'] = [dict(type=t, id=str(r)) for t, r in zip(ref_types[refs], ref_ids[refs])]
+            elif not undefined[i]:
+                d['referenced_tweets'] = []
+            data.append(d)
+
+        fp = outdir / '{}_data_{}.json'. format(prefix, f)
+        with open(fp, 'w') as fh:
+            json.dump(data, fh)
+        paths.append(fp)
+        v and print('wrote {} tweets to {}'. format(len(rows), fp))
+
+    return paths
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic Twitter v2 corpus.')
+    parser.add_argument('--tweets', type=int, default=100000)
+    parser.add_argument('--files', type=int, default=10)
+    parser.add_argument('--outdir', default='data/synth/')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-v', action='store_true')
+    args = parser.parse_args(argv)
+    generate(args.tweets, args.outdir, n_files=args.files, seed=args.seed, v=args.v)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+'''
+Hashtag statistics accumulated chunk by chunk.
+
+TagStats keeps two aggregates: the number of tweets per tag count (histogram), and the
+usage count of every tag in tweets with more than one tag (the tags of the hashtag
+network). Each chunk of tag lists updates them in a single vectorized pass. Tags are
+mapped to integer codes, either their own (interned tags) or through a vocab.Vocabulary
+owned by the stats. Partial stats of separate chunks or processes combine with merge, so
+the stats of a corpus that does not fit in memory can be built from parse.stream_tweets
+batches or from slices of a columnar.TweetTable. Summaries and figures come from the
+aggregates only.
+'''
+import numpy as np
+import pandas as pd
+from vocab import Vocabulary
+
+
+class TagStats:
+
+    def __init__(self):
+        self.histogram = np.zeros(1, dtype=np.int64)
+        self.usage = np.zeros(0, dtype=np.int64)
+        # None while tags are integer codes, set on the first chunk of string tags
+        self.vocab = None
+
+    def __len__(self):
+        return int(self.histogram.sum())
+
+    def __repr__(self):
+        return 'TagStats of {} tweets and {} tags'. format(len(self), self.n_unique())
+
+    def _codes(self, values):
+        values = np.asarray(values)
+        if len(values) == 0:
+            return np.zeros(0, dtype=np.int64)
+        integer = values.dtype.kind in 'iu' or isinstance(values[0], (int, np.integer))
+        if integer and self.vocab is None:
+            return values.astype(np.int64)
+        if integer or len(self.usage) and self.vocab is None:
+            raise ValueError('Cannot mix integer tag codes and tag labels in one TagStats.')
+        self.vocab = self.vocab or Vocabulary()
+        return self.vocab.encode(values).astype(np.int64)
+
+    def update(self, lengths, values):
+        '''
+        Add a chunk of tweets given the number of tags of every tweet and the flat array of
+        their tags (codes or labels) in tweet order.
+        '''
+        lengths = np.asarray(lengths, dtype=np.int64)
+        counts = np.bincount(lengths)
+        if len(counts) > len(self.histogram):
+            self.histogram = np.pad(self.histogram, (0, len(counts) - len(self.histogram)))
+        self.histogram[:len(counts)] += counts
+
+        # only tags of tweets with multiple tags are in the network
+        multi = np.repeat(lengths > 1, lengths)
+        codes = self._codes(np.asarray(values)[multi])
+        if len(codes):
+            self._add_usage(np.bincount(codes))
+        return self
+
+    def update_lists(self, tags):
+        '''Add a chunk given as a sequence of tag lists (e.g. the tags column of tweetsdf).'''
+        lengths = np.fromiter((len(t) for t in tags), dtype=np.int64, count=len(tags))
+        return self.update(lengths, np.array([t for l in tags for t in l], dtype=object))
+
+    def _add_usage(self, usage):
+        if len(usage) > len(self.usage):
+            self.usage = np.pad(self.usage, (0, len(usage) - len(self.usage)))
+        self.usage[:len(usage)] += usage
+
+    def merge(self, other):
+        '''Add the aggregates of other (stats of another chunk) to these.'''
+        if len(other.histogram) > len(self.histogram):
+            self.histogram = np.pad(self.histogram, (0, len(other.histogram) - len(self.histogram)))
+        self.histogram[:len(other.histogram)] += other.histogram
+
+        used = np.flatnonzero(other.usage)
+        if len(used):
+            codes = self._codes(used if other.vocab is None else other.vocab.decode(used))
+            self._add_usage(np.bincount(codes, weights=other.usage[used]).astype(np.int64))
+        return self
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        '''Stats of an iterable of tag list chunks.'''
+        stats = cls()
+        for chunk in chunks:
+            stats.update_lists(chunk)
+        return stats
+
+    def n_unique(self):
+        return int(np.count_nonzero(self.usage))
+
+    def counts(self, name='tags'):
+        '''
+        Usage count of every tag used in a tweet with multiple tags, most used first (ties
+        in order of first use), as value_counts of the exploded tags would give.
+        '''
+        used = np.flatnonzero(self.usage)
+        # codes of labels are in order of first use, integer codes are ordered as they are
+        order = used[np.argsort(-self.usage[used], kind='stable')]
+        labels = order if self.vocab is None else self.vocab.decode(order)
+        return pd.Series(self.usage[order], index=pd.Index(labels, name=name))
+
+    def summary(self, threshold=10, n_top=40):
+        '''
+        dict with the number (and fraction) of tweets without, with one and with multiple
+        tags, the number of unique tags, of tags used once and of tags used `threshold`
+        times or less (and their fractions of the unique tags) and the top n_top tags.
+        '''
+        n = max(len(self), 1)
+        used = self.usage[self.usage > 0]
+        n_unique = max(len(used), 1)
+        out = dict(
+                tweets=len(self),
+                without_tags=int(self.histogram[0]),
+                one_tag=int(self.histogram[1]) if len(self.histogram) > 1 else 0,
+                multiple_tags=int(self.histogram[2:].sum()),
+                unique_tags=len(used),
+                used_once=int((used == 1).sum()),
+                threshold=threshold,
+                used_threshold_or_less=int((used <= threshold).sum()),
+                top=self.counts().head(n_top))
+        for k in ('without_tags', 'one_tag', 'multiple_tags'):
+            out[k + '_fraction'] = out[k] / n
+        for k in ('used_once', 'used_threshold_or_less'):
+            out[k + '_fraction'] = out[k] / n_unique
+        return out
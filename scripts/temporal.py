@@ -0,0 +1,225 @@
+'''
+Retweet and hashtag networks of time windows.
+
+Every connection is an event with the time of the tweet it comes from: a resolved
+retweet reference at the time of the retweet, a hashtag pair at the time of the tweet.
+Events are sorted by time once and every distinct (undirected) edge gets an integer id.
+Sliding a window over the sorted events then only touches the events that enter or
+leave it: their edge weights are incremented and decremented, and the edges of the
+window are the previously active edges plus the entering ones that still have weight.
+The cost is linear in the number of events plus the size of the emitted networks,
+instead of a rebuild with rt_source_to_target and write_edgelist per window.
+
+Windows are [t0, t0 + size) for t0 = start, start + step, ... (tumbling windows if step
+equals size, rolling windows if it is smaller).
+'''
+from pathlib import Path
+import json
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from columnar import TweetTable
+from csrgraph import CSRGraph
+from build_net import resolve_references, tag_pairs
+from instrument import staged, gauge, progress
+
+
+class TemporalEdges:
+    '''
+    Time sorted edge events: times (int64 ms since epoch), edge (edge id of every event),
+    lo, hi (node codes of every edge id, lo < hi, edge ids sorted by (lo, hi)) and
+    nodes (node labels by code, sorted).
+    '''
+
+    def __init__(self, times, edge, lo, hi, nodes):
+        self.times = times
+        self.edge = edge
+        self.lo = lo
+        self.hi = hi
+        self.nodes = nodes
+
+    def __len__(self):
+        return len(self.times)
+
+    def __repr__(self):
+        return 'TemporalEdges with {} events on {} edges between {} nodes'. format(len(self), len(self.lo), len(self.nodes))
+
+    @classmethod
+    def from_events(cls, times, sources, targets):
+        '''Events from their times (datetime64) and node labels, self-loops are dropped.'''
+        times = np.asarray(times, dtype='datetime64[ms]').astype(np.int64)
+        sources, targets = np.asarray(sources), np.asarray(targets)
+        keep = sources != targets
+        times, sources, targets = times[keep], sources[keep], targets[keep]
+
+        # sorted codes, so edges come out in the order of write_edgelist
+        codes, nodes = pd.factorize(np.concatenate([sources, targets]), sort=True)
+        n = max(len(nodes), 1)
+        s, t = codes[:len(sources)].astype(np.int64), codes[len(sources):].astype(np.int64)
+        keys, edge = np.unique(np.minimum(s, t) * n + np.maximum(s, t), return_inverse=True)
+
+        order = np.argsort(times, kind='stable')
+        return cls(times[order], edge.ravel()[order], keys // n, keys % n, np.asarray(nodes))
+
+    def windows(self, size, step=None, start=None, end=None):
+        '''
+        Slide a window over the events.
+        size, step: pandas Timedelta or string ('1h', '1D'), step defaults to size
+        start: first window start, by default the first event time floored to step
+        end: no window starts after end, by default the last event time
+
+        Yields:
+        -------
+        (t0, t1, edges, weights) for every window: window bounds as pandas Timestamps, ids
+        (sorted) and weights of the edges with at least one event in [t0, t1)
+        '''
+        size = pd.Timedelta(size)
+        step = pd.Timedelta(step) if step is not None else size
+        size_ms, step_ms = size // pd.Timedelta(milliseconds=1), step // pd.Timedelta(milliseconds=1)
+        if not len(self) and (start is None or end is None):
+            return
+        t0 = int(pd.Timestamp(start).value // 10 ** 6) if start is not None else self.times[0] // step_ms * step_ms
+        end = int(pd.Timestamp(end).value // 10 ** 6) if end is not None else self.times[-1]
+
+        weights = np.zeros(len(self.lo), dtype=np.int64)
+        active = np.zeros(0, dtype=np.int64)
+        lo = hi = 0
+        while t0 <= end:
+            new_lo = np.searchsorted(self.times, t0, side='left')
+            new_hi = np.searchsorted(self.times, t0 + size_ms, side='left')
+            # events skipped between two windows (step > size) never enter
+            entering = self.edge[max(hi, new_lo):new_hi]
+            leaving = self.edge[lo:min(new_lo, hi)]
+
+            ids, counts = np.unique(entering, return_counts=True)
+            weights[ids] += counts
+            ids_out, counts_out = np.unique(leaving, return_counts=True)
+            weights[ids_out] -= counts_out
+
+            active = np.union1d(active, ids)
+            active = active[weights[active] > 0]
+            lo, hi = new_lo, max(hi, new_hi)
+            yield pd.Timestamp(t0, unit='ms'), pd.Timestamp(t0 + size_ms, unit='ms'), active, weights[active]
+            t0 += step_ms
+
+    def edgelist(self, edges, weights):
+        '''Data frame (source, target, weight) of edge ids, as build_net.write_edgelist returns.'''
+        return pd.DataFrame({'source': self.nodes[self.lo[edges]], 'target': self.nodes[self.hi[edges]], 'weight': weights})
+
+    def graph(self, edges, weights):
+        '''csrgraph.CSRGraph of edge ids, with only the nodes of these edges.'''
+        used, codes = np.unique(np.concatenate([self.lo[edges], self.hi[edges]]), return_inverse=True)
+        codes = codes.ravel()
+        return CSRGraph.from_edges(codes[:len(edges)], codes[len(edges):], weights, labels=self.nodes[used])
+
+
+
+def rt_events(tweets, retweets):
+    '''TemporalEdges of the retweet network: author of the original -> author of the retweet, at the retweet time.'''
+    rows, refs, matches, sources = resolve_references(tweets, retweets)
+    single = matches == 1
+    times = np.asarray(retweets['created_at'])[rows[single]]
+    targets = np.asarray(retweets['author_id'])[rows[single]]
+    return TemporalEdges.from_events(times, tweets.labels(sources[single]), retweets.labels(targets))
+
+
+
+def ht_events(tweets):
+    '''TemporalEdges of the hashtag network: every tag pair of a tweet with multiple tags, at the tweet time.'''
+    rows, a, b = tag_pairs(tweets['tags'])
+    return TemporalEdges.from_events(np.asarray(tweets['created_at'])[rows], tweets.tag_labels(a), tweets.tag_labels(b))
+
+
+
+def graph_summary(g, clustering=True):
+    '''Size, weight, strength and clustering summary of a CSRGraph.'''
+    out = dict(nodes=g.number_of_nodes(), edges=g.number_of_edges())
+    if not out['edges']:
+        return out
+    strengths = g.strengths()
+    weights = g.weights()
+    out.update(weight=float(weights.sum()), max_weight=float(weights.max()), mean_strength=float(strengths.mean()),
+            max_strength=float(strengths.max()), lcc_nodes=int(g.largest_component_mask().sum()))
+    if clustering:
+        out['mean_clustering'] = float(g.clustering().mean())
+    return out
+
+
+
+def _write_edges(edges, fp, chunksize=500000):
+    with open(fp, 'w') as f:
+        for start in range(0, len(edges), chunksize):
+            edges.iloc[start:start+chunksize].to_csv(f, sep=' ', header=False, index=False)
+
+
+
+@staged
+def temporal_networks(tweets, retweets, size='1D', step=None, start=None, end=None, outdir=None, figdir=None, summaryfp=None,
+        clustering=True, v=False):
+    '''
+    Retweet and hashtag networks of sliding time windows.
+
+    Args:
+    -----
+    tweets, retweets: original tweets and retweets as columnar.TweetTable or lists of
+        parsed records (see build_net.format_tweets(..., table=True))
+    size, step, start, end: windows, see TemporalEdges.windows. The same windows are used
+        for both networks (start and end default to the first and last event of either).
+    outdir: directory the edgelists of every window are written to, as
+        rt_edgelist_<window start>.txt and ht_edgelist_<window start>.txt
+    figdir: directory for the vis.vis_net_stats figures of the largest components of every window
+    summaryfp: json file for the window summaries
+    clustering: include the mean clustering coefficient in the summaries
+
+    Returns:
+    -------
+    list of dicts, one per window: start, end and graph_summary of both networks
+    '''
+    from vis import vis_net_stats
+    tweets = tweets if isinstance(tweets, TweetTable) else TweetTable.from_records(tweets)
+    retweets = retweets if isinstance(retweets, TweetTable) else TweetTable.from_records(retweets)
+
+    events = dict(rt=rt_events(tweets, retweets), ht=ht_events(tweets))
+    v and print('Retweet network: {}.\nHashtag network: {}.'. format(events['rt'], events['ht']))
+    gauge('rt_events', len(events['rt']))
+    gauge('ht_events', len(events['ht']))
+
+    times = np.concatenate([e.times[[0, -1]] for e in events.values() if len(e)])
+    if not len(times):
+        return []
+    step_ms = pd.Timedelta(step if step is not None else size) // pd.Timedelta(milliseconds=1)
+    start = pd.Timestamp(start) if start is not None else pd.Timestamp(times.min() // step_ms * step_ms, unit='ms')
+    end = pd.Timestamp(end) if end is not None else pd.Timestamp(times.max(), unit='ms')
+
+    for d in (outdir, figdir):
+        d and Path(d).mkdir(parents=True, exist_ok=True)
+
+    summaries = []
+    windows = zip(*(e.windows(size, step, start, end) for e in events.values()))
+    for (t0, t1, rt_edges, rt_weights), (_, _, ht_edges, ht_weights) in progress(windows, desc='windows', show=v or None):
+        stamp = t0.strftime('%Y%m%dT%H%M%S')
+        graphs = dict(rt=events['rt'].graph(rt_edges, rt_weights), ht=events['ht'].graph(ht_edges, ht_weights))
+        summary = dict(start=t0.isoformat(), end=t1.isoformat())
+        for name, g in graphs.items():
+            summary[name] = graph_summary(g, clustering=clustering)
+
+        if outdir:
+            _write_edges(events['rt'].edgelist(rt_edges, rt_weights), Path(outdir) / 'rt_edgelist_{}.txt'. format(stamp))
+            _write_edges(events['ht'].edgelist(ht_edges, ht_weights), Path(outdir) / 'ht_edgelist_{}.txt'. format(stamp))
+
+        if figdir and all(g.number_of_edges() for g in graphs.values()):
+            vis_net_stats(graphs['rt'].largest_component(), graphs['ht'].largest_component(),
+                    overviewfp=Path(figdir) / 'overview_{}.png'. format(stamp), clusteringfp=Path(figdir) / 'clustering_{}.png'. format(stamp), v=False)
+            plt.close('all')
+
+        summaries.append(summary)
+
+    gauge('windows', len(summaries))
+    v and print('{} windows of {} from {} to {}.'. format(len(summaries), size, start, end))
+
+    if summaryfp:
+        with open(summaryfp, 'w') as f:
+            json.dump(summaries, f, indent=1)
+        v and print('Window summaries written to {}'. format(summaryfp))
+
+    return summaries
@@ -6,19 +6,45 @@ import seaborn as sns
 import pandas as pd
 import numpy as np
 import matplotlib
+from matplotlib.collections import LineCollection
+from matplotlib.colors import Normalize, LogNorm
 import json
 import warnings
+from csrgraph import CSRGraph
+from paths import path_stats
+from layout import layout
+from instrument import staged, gauge
 
-def parse_net_components(rtedgelistfp, htedgelistfp, figfp=None, figtitle='Distribution of connected component sizes', v=True):
-    rt_g = nx.read_weighted_edgelist(rtedgelistfp)
-    rt_connected = [len(c) for c in sorted(nx.connected_components(rt_g), key=len, reverse=True)]
-    rt_largest_cc = max(nx.connected_components(rt_g), key=len)
-    rt_h = deepcopy(rt_g.subgraph(rt_largest_cc))
+@staged
+def parse_net_components(rtedgelistfp, htedgelistfp, figfp=None, figtitle='Distribution of connected component sizes', nodetype=str, backend='networkx', v=True):
+    '''
+    nodetype: int for edgelists of vocabulary codes (build_net.write_edgelist without labels),
+        nodes then stay integer codes and are translated with vocab.Vocabulary at output.
+    backend: 'networkx' returns networkx graphs, 'csr' returns csrgraph.CSRGraph, computing
+        components and the largest component on the sparse adjacency matrix
+        (networkx graphs are then available through CSRGraph.to_networkx).
+        The csr backend also reads graphs saved with CSRGraph.save (.npz files).
+    '''
+    if backend == 'csr':
+        rt_g = CSRGraph.read(rtedgelistfp, nodetype=nodetype)
+        rt_connected = rt_g.component_sizes()
+        rt_h = rt_g.largest_component()
 
-    ht_g = nx.read_weighted_edgelist(htedgelistfp)
-    ht_connected = [len(c) for c in sorted(nx.connected_components(ht_g), key=len, reverse=True)]
-    ht_largest_cc = max(nx.connected_components(ht_g), key=len)
-    ht_h = deepcopy(ht_g.subgraph(ht_largest_cc))
+        ht_g = CSRGraph.read(htedgelistfp, nodetype=nodetype)
+        ht_connected = ht_g.component_sizes()
+        ht_h = ht_g.largest_component()
+        v and print('Loaded {} and {}.'. format(rt_g, ht_g))
+
+    else:
+        rt_g = nx.read_weighted_edgelist(rtedgelistfp, nodetype=nodetype)
+        rt_connected = [len(c) for c in sorted(nx.connected_components(rt_g), key=len, reverse=True)]
+        rt_largest_cc = max(nx.connected_components(rt_g), key=len)
+        rt_h = deepcopy(rt_g.subgraph(rt_largest_cc))
+
+        ht_g = nx.read_weighted_edgelist(htedgelistfp, nodetype=nodetype)
+        ht_connected = [len(c) for c in sorted(nx.connected_components(ht_g), key=len, reverse=True)]
+        ht_largest_cc = max(nx.connected_components(ht_g), key=len)
+        ht_h = deepcopy(ht_g.subgraph(ht_largest_cc))
 
     if figfp:
         sns.set_theme(style='whitegrid', font_scale=.5)
@@ -37,12 +63,33 @@ def parse_net_components(rtedgelistfp, htedgelistfp, figfp=None, figtitle='Distr
         except Exception as e:
             print(e)
 
+    for name, g in (('rt', rt_g), ('ht', ht_g)):
+        gauge(name + '_nodes', g.number_of_nodes())
+        gauge(name + '_edges', g.number_of_edges())
+    gauge('rt_components', len(rt_connected))
+    gauge('ht_components', len(ht_connected))
+
     return dict(rt_g=rt_g, rt_h=rt_h, ht_g=ht_g, ht_h=ht_h)
 
 
 
-def vis_net_stats(rtg, htg, compute_paths=False, overviewfp=None, clusteringfp=None, v=True, vv=False):
-    
+@staged
+def vis_net_stats(rtg, htg, compute_paths=False, overviewfp=None, clusteringfp=None, path_sources=None, workers=None, seed=None, v=True, vv=False):
+    '''
+    rtg, htg: networkx graphs or csrgraph.CSRGraph
+    compute_paths: shortest path statistics (see paths.path_stats) of each graph, which must be
+        connected (pass the largest components). Exact unless path_sources gives a number of
+        sampled source nodes; runs in `workers` processes.
+    seed: seed of the sampled source nodes, for the same statistics on every run
+
+    Returns:
+    -------
+    dict of the computed distributions and path statistics
+    '''
+    for name, g in (('rt', rtg), ('ht', htg)):
+        gauge(name + '_nodes', g.number_of_nodes())
+        gauge(name + '_edges', g.number_of_edges())
+
     #sns.set_theme(style='whitegrid', font_scale=.5)
     matplotlib.rc_file_defaults()
     fig = plt.figure(figsize=(6,6))
@@ -59,22 +106,31 @@ def vis_net_stats(rtg, htg, compute_paths=False, overviewfp=None, clusteringfp=N
 
         for g, name in zip((rtg,htg), ('retweets', 'hashtags')):
             # Node strength (degree disrtibution)
-            strengths = [g.degree(n, weight='weight') for n in g.nodes()]
+            if isinstance(g, CSRGraph):
+                strengths = g.strengths()
+            else:
+                strengths = [g.degree(n, weight='weight') for n in g.nodes()]
             data[name+'_strengths'] = strengths
             v and print('{} strengths recorded.'. format(name+'_strengths'))
 
             # Edge weight distribution
-            weights = [e[2]['weight'] for e in g.edges(data=True)]
+            if isinstance(g, CSRGraph):
+                weights = g.weights()
+            else:
+                weights = [e[2]['weight'] for e in g.edges(data=True)]
             data[name+'_weights'] = weights
             v and print('{} weights recorded.'. format(name+'_weights'))
 
             # Shortest path lengths
             if compute_paths:
-                warnings.warn('Processing shortest path is slow, use smallest reasonable component.')
-                if not nx.is_connected(g):
+                path_sources or warnings.warn('Processing exact shortest paths is slow, use smallest reasonable component or path_sources.')
+                csr = g if isinstance(g, CSRGraph) else CSRGraph.from_networkx(g)
+                if csr.components()[0] > 1:
                     raise nx.NetworkXError("Graph is not connected.")
-                aspl = nx.average_shortest_path_length(h, weight='weight')
-                print('Average shortest path length of largest connected component is {}.' .format(aspl))
+                paths = path_stats(csr.adjacency, n_sources=path_sources, weighted=True, workers=workers, seed=seed, v=vv)
+                data[name+'_paths'] = paths
+                print('Average shortest path length of largest connected component is {:.4f} (95% CI {:.4f} - {:.4f}, {} sources), diameter {} {}.'
+                        .format(paths['mean'], *paths['ci95'], paths['n_sources'], 'is' if paths['exact'] else '>=', paths['diameter']))
 
         # histogram
         subtitles = ['Retweet node strengths', 'Retweet edge weights', 'Hashtag node strengths', 'Hashtag edge weights']
@@ -97,16 +153,18 @@ def vis_net_stats(rtg, htg, compute_paths=False, overviewfp=None, clusteringfp=N
         fig.suptitle(suptitle)
 
         for g, name in zip((rtg,htg), ('retweets', 'hashtags')):
-            clustering = [i for i in nx.clustering(g, weight='weight').values()]
+            g = g if isinstance(g, CSRGraph) else CSRGraph.from_networkx(g)
+            clustering = g.clustering()
             data[name+'_full_clustering'] = clustering
             v and print('{} clustering coefficients computed'. format(name+'_full_clustering'))
 
             # use lcc only
-            largest_cc = max(nx.connected_components(g), key=len)
-            h = deepcopy(g.subgraph(largest_cc))
             # Clustering coefficient distribution
-
-            clustering = [i for i in nx.clustering(h, weight='weight').values()]
+            # coefficients are local, the lcc only differs in the weight normalization
+            lcc = g.largest_component_mask()
+            max_weight = g.adjacency.data.max() if g.adjacency.nnz else 1
+            lcc_max_weight = g.adjacency[lcc].max() if lcc.any() else 1
+            clustering = clustering[lcc] * max_weight / lcc_max_weight
             data[name+'_lcc_clustering'] = clustering
             v and print('{} clustering coefficients computed'. format(name+'_lcc_clustering'))
 
@@ -124,13 +182,33 @@ def vis_net_stats(rtg, htg, compute_paths=False, overviewfp=None, clusteringfp=N
             print('Figure {} saved to {}'. format(suptitle, clusteringfp))
         except Exception as e:
             print(e)
-    
-        
 
+    return data
 
-def vis_net(g, _pos=None, recomputepos=False, niter=None, posfp=None, lcc_only=False, gexffp=None, visnetfp=None, title='', v=False):
-    
-    if recomputepos:
+
+
+@staged
+def vis_net(g, _pos=None, recomputepos=False, niter=None, posfp=None, lcc_only=False, gexffp=None, visnetfp=None, title='', labels=None,
+        engine='fa2', checkpoint_every=0, resume=False, settle_new_only=False,
+        renderer='networkx', edge_quantile=0., max_edges=None, edge_mode='lines', chunksize=500000, v=False):
+    '''
+    labels: vocab.Vocabulary if the nodes of g are codes, nodes are written with their labels
+        to the gexf file and the verbose node and edge tables.
+    engine: 'fa2' computes positions with fa2.ForceAtlas2, 'numpy' with layout.layout on the
+        sparse adjacency matrix, which writes positions to posfp every `checkpoint_every`
+        iterations, can `resume` from posfp, and warm starts from _pos (only moving the
+        nodes not in _pos if settle_new_only).
+    renderer: 'networkx' draws with nx.draw_networkx, 'fast' with draw_net from position and
+        weight arrays (see draw_net for edge_quantile, max_edges, edge_mode and chunksize).
+        g can also be a csrgraph.CSRGraph with the fast renderer.
+    '''
+    gauge('nodes', g.number_of_nodes())
+    gauge('edges', g.number_of_edges())
+
+    if recomputepos and engine == 'numpy':
+        pos = layout(g, pos=_pos, niter=niter, posfp=posfp, checkpoint_every=checkpoint_every, resume=resume, settle_new_only=settle_new_only, v=v)
+        posfp and print('Positions written to {}'. format(posfp))
+    elif recomputepos:
         forceatlas2 = ForceAtlas2()
         pos = forceatlas2.forceatlas2_networkx_layout(g, pos=_pos, iterations=niter)
 
@@ -148,9 +226,30 @@ def vis_net(g, _pos=None, recomputepos=False, niter=None, posfp=None, lcc_only=F
     #    h = deepcopy(g.subgraph(largest_cc))
     #    g = h
 
-    gexffp and nx.write_gexf(g, gexffp)
+    if gexffp:
+        g = g.to_networkx() if isinstance(g, CSRGraph) else g
+        nx.write_gexf(g if labels is None else nx.relabel_nodes(g, dict(zip(g.nodes(), labels.decode(list(g.nodes()))))), gexffp)
+
+    if visnetfp and renderer == 'fast':
+        fig = plt.figure(figsize=(9, 9))
+        ax = fig.add_subplot(1,1,1)
+        ax.set(title=title)
+        print('Drawing figure')
+        nodes, strengths, (sources, targets, weights) = draw_net(g, pos, ax, edge_quantile=edge_quantile, max_edges=max_edges, edge_mode=edge_mode, chunksize=chunksize)
+        gauge('edges_drawn', len(weights))
+        plt.axis('off')
+        fig.savefig(visnetfp)
+        print('Figure {} written to {}'. format(title, visnetfp))
+
+        if v:
+            if labels is not None:
+                nodes, sources, targets = labels.decode(nodes), labels.decode(sources), labels.decode(targets)
+            ndf = pd.DataFrame(strengths, nodes)
+            edf = pd.DataFrame(weights, pd.MultiIndex.from_arrays([sources, targets]))
+            print('-----\nNodes:\n{}\nEdges:\n{}\n'. format(ndf, edf))
+            return g, pos, ndf, edf
 
-    if visnetfp:
+    elif visnetfp:
         nodes = [n for n in g.nodes()]
         edges = [e for e in g.edges(data=True)]
         strengths = [g.degree(n, weight='weight') for n in nodes]
@@ -185,9 +284,119 @@ def vis_net(g, _pos=None, recomputepos=False, niter=None, posfp=None, lcc_only=F
         print('Figure {} written to {}'. format(title, visnetfp))
 
         if v:
+            pairs = [(e[0], e[1]) for e in edges]
+            if labels is not None:
+                nodes = labels.decode(nodes)
+                pairs = list(zip(labels.decode([p[0] for p in pairs]), labels.decode([p[1] for p in pairs])))
             ndf = pd.DataFrame(strengths, nodes)
-            edf = pd.DataFrame(weights, [(e[0], e[1]) for e in edges])
+            edf = pd.DataFrame(weights, pairs)
             print('-----\nNodes:\n{}\nEdges:\n{}\n'. format(ndf, edf))
             return g, pos, ndf, edf
 
     return g, pos
+
+
+
+def draw_net(g, pos, ax, edge_quantile=0., max_edges=None, edge_mode='lines', chunksize=500000, cmap='YlGnBu', alpha=.42, node_size=18, bins=1024):
+    '''
+    Draw a network from position and weight arrays, with the colors of vis_net.
+    Edges are drawn as LineCollections of at most `chunksize` edges (heaviest on top), each
+    rasterized as it is drawn and composited into one image (see _composite_chunks), so
+    memory does not grow with the number of edges. Nodes are one scatter colored by strength.
+
+    Args:
+    -----
+    g: networkx graph or csrgraph.CSRGraph
+    pos: dict node -> (x, y)
+    edge_quantile: only draw edges with a weight at or above this quantile of the weights
+    max_edges: draw at most this many edges (the heaviest)
+    edge_mode: 'lines' draws edges, 'density' draws a bins x bins image of the edge density
+        (weights accumulated along the edges), which costs the same for any number of edges
+
+    Returns:
+    -------
+    nodes, strengths, (sources, targets, weights) of the drawn graph, as arrays
+    '''
+    g = g if isinstance(g, CSRGraph) else CSRGraph.from_networkx(g)
+    xy = np.array([pos[l] if l in pos else pos[str(l)] for l in g.labels], dtype=np.float64).reshape(-1, 2)
+    strengths = g.strengths()
+    i, j, w = g.edges()
+
+    keep = np.ones(len(w), dtype=bool) if not len(w) else w >= np.quantile(w, edge_quantile)
+    order = np.flatnonzero(keep)[np.argsort(w[keep], kind='stable')]
+    if max_edges is not None:
+        order = order[len(order) - max_edges:] if max_edges else order[:0]
+
+    if len(w):
+        norm = Normalize(vmin=np.quantile(w, 0), vmax=np.quantile(w, .5))
+
+    if edge_mode == 'density' and len(order):
+        lo, hi = xy.min(axis=0), xy.max(axis=0)
+        density = np.zeros((bins, bins))
+        t = np.linspace(0, 1, 16)[:, None, None]
+        for start in range(0, len(order), chunksize):
+            e = order[start:start+chunksize]
+            points = xy[i[e]] + t * (xy[j[e]] - xy[i[e]])
+            density += np.histogram2d(points[..., 0].ravel(), points[..., 1].ravel(), bins=bins, range=[[lo[0], hi[0]], [lo[1], hi[1]]],
+                    weights=np.broadcast_to(w[e], points.shape[:2]).ravel())[0]
+        ax.imshow(np.ma.masked_equal(density.T, 0), origin='lower', extent=(lo[0], hi[0], lo[1], hi[1]), cmap=cmap,
+                norm=LogNorm(), alpha=alpha, interpolation='nearest', aspect='auto')
+
+    elif edge_mode == 'lines' and len(order):
+        # the limits of the nodes are fixed before the edges are rasterized
+        ax.update_datalim(xy)
+        ax.autoscale_view()
+        chunks = (LineCollection(np.stack([xy[i[e]], xy[j[e]]], axis=1), array=w[e], cmap=cmap, norm=norm, alpha=alpha, linewidths=1.)
+                for e in (order[start:start+chunksize] for start in range(0, len(order), chunksize)))
+        _composite_chunks(ax, chunks)
+
+    elif len(order) and edge_mode != 'lines':
+        raise ValueError('Unknown edge_mode {}, use "lines" or "density".'. format(edge_mode))
+
+    ax.scatter(xy[:, 0], xy[:, 1], c=strengths, s=node_size, cmap=cmap, linewidths=.42, edgecolors='face', alpha=alpha,
+            vmin=np.quantile(strengths, 0) if len(strengths) else None, vmax=np.quantile(strengths, .9) if len(strengths) else None,
+            rasterized=len(strengths) > 10000, zorder=2)
+    ax.autoscale_view()
+
+    return g.labels, strengths, (g.labels[i[order]], g.labels[j[order]], w[order])
+
+
+
+def _composite_chunks(ax, chunks, dpi=None):
+    '''
+    Draw every collection of `chunks` alone on an offscreen Agg canvas with the size and
+    limits of ax, and composite the renderings (later chunks on top) into one image shown
+    on ax. Only one chunk and the image are in memory at a time.
+    dpi: resolution of the image, by default that of savefig.
+    '''
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    if dpi is None:
+        dpi = ax.figure.dpi if matplotlib.rcParams['savefig.dpi'] == 'figure' else matplotlib.rcParams['savefig.dpi']
+    bbox = ax.get_position()
+    width, height = ax.figure.get_size_inches()
+    fig = Figure(figsize=(width * bbox.width, height * bbox.height), dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    fig.patch.set_alpha(0)
+    off = fig.add_axes([0, 0, 1, 1])
+    off.set_axis_off()
+    xlim, ylim = ax.get_xlim(), ax.get_ylim()
+    off.set(xlim=xlim, ylim=ylim)
+
+    image = None
+    for collection in chunks:
+        off.add_collection(collection)
+        canvas.draw()
+        rgba = np.asarray(canvas.buffer_rgba(), dtype=np.float32) / 255
+        collection.remove()
+        # "over" operator on premultiplied colors
+        alpha = rgba[..., 3:]
+        image = np.zeros_like(rgba) if image is None else image
+        image[..., :3] = rgba[..., :3] * alpha + image[..., :3] * (1 - alpha)
+        image[..., 3:] = alpha + image[..., 3:] * (1 - alpha)
+
+    if image is not None:
+        alpha = image[..., 3:]
+        image[..., :3] = np.divide(image[..., :3], alpha, out=np.zeros_like(image[..., :3]), where=alpha > 0)
+        ax.imshow(image, extent=(*xlim, *ylim), aspect='auto', interpolation='nearest', zorder=1)
+        ax.set(xlim=xlim, ylim=ylim)
@@ -0,0 +1,108 @@
+'''
+Interning of tweet ids, author ids and hashtags.
+
+Every entity is mapped once to a dense integer code (0, 1, 2, ... in order of first
+appearance), the codes are carried through parsing, joining, edge counting and the
+network stages, and are translated back to labels only when writing output.
+Tweet ids and referenced tweet ids share the 'tweets' vocabulary so they can be joined on.
+'''
+import json
+import numpy as np
+import pandas as pd
+
+ENTITIES = ('tweets', 'authors', 'tags')
+
+
+class Vocabulary:
+    '''
+    Bidirectional mapping between labels (strings) and dense integer codes.
+    '''
+
+    def __init__(self, labels=()):
+        self.labels = []
+        self.index = {}
+        self._array = None
+        for label in labels:
+            self.add(label)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, label):
+        return label in self.index
+
+    @property
+    def dtype(self):
+        return np.int32 if len(self) < np.iinfo(np.int32).max else np.int64
+
+    def add(self, label):
+        '''Returns the code of label, adding it to the vocabulary if it is new.'''
+        code = self.index.get(label)
+        if code is None:
+            code = len(self.labels)
+            self.index[label] = code
+            self.labels.append(label)
+            self._array = None
+        return code
+
+    def encode(self, labels):
+        '''Codes of a sequence of labels, new labels are added. Returns an integer array.'''
+        codes, uniques = pd.factorize(np.asarray(labels, dtype=object))
+        unique_codes = np.fromiter((self.add(u) for u in uniques), dtype=np.int64, count=len(uniques))
+        return unique_codes[codes].astype(self.dtype)
+
+    def lookup(self, labels):
+        '''Codes of a sequence of labels without adding them, unknown labels get -1.'''
+        codes, uniques = pd.factorize(np.asarray(labels, dtype=object))
+        unique_codes = np.fromiter((self.index.get(u, -1) for u in uniques), dtype=np.int64, count=len(uniques))
+        return unique_codes[codes]
+
+    def decode(self, codes):
+        '''Labels of an array of codes, returns an object array.'''
+        if self._array is None:
+            self._array = np.array(self.labels, dtype=object)
+        return self._array[np.asarray(codes, dtype=np.int64)]
+
+    def save(self, fp):
+        with open(fp, 'w') as f:
+            json.dump(self.labels, f)
+
+    @classmethod
+    def load(cls, fp):
+        with open(fp, 'r') as f:
+            return cls(json.load(f))
+
+
+
+def make_vocabs():
+    '''One empty vocabulary per entity type.'''
+    return {e: Vocabulary() for e in ENTITIES}
+
+
+
+def intern_records(records, vocabs):
+    '''
+    Replace tweet ids, author ids, referenced tweet ids and tags of parsed tweet records
+    (see parse.parse_tweet) by their codes, in place. full_ref_data is left as it is.
+    '''
+    tweets, authors, tags = (vocabs[e] for e in ENTITIES)
+
+    for r in records:
+        r['tweet_id'] = tweets.add(r['tweet_id'])
+        r['author_id'] = authors.add(r['author_id'])
+        if isinstance(r['referenced_tweet_id'], list):
+            r['referenced_tweet_id'] = [tweets.add(i) for i in r['referenced_tweet_id']]
+        r['tags'] = [tags.add(t) for t in r['tags']]
+
+    return records
+
+
+
+def save_vocabs(vocabs, dirpath):
+    for e, vocab in vocabs.items():
+        vocab.save(dirpath + 'vocab_' + e + '.json')
+
+
+
+def load_vocabs(dirpath):
+    return {e: Vocabulary.load(dirpath + 'vocab_' + e + '.json') for e in ENTITIES}
@@ -0,0 +1,66 @@
+from collections import Counter
+import pandas as pd
+import pytest
+from build_net import format_tweets, rt_source_to_target, write_edgelist
+
+
+def _tweet(tweet_id, author_id, refs=None):
+    record = dict(tweet_id=str(tweet_id), author_id=str(author_id), created_at='2021-03-01T00:00:00.000Z', tags=[])
+    record['referenced_tweet_id'] = None if refs is None else [str(r) for r in refs]
+    if refs is not None:
+        record['full_ref_data'] = [{'type': 'retweeted', 'id': str(r)} for r in refs]
+    return record
+
+
+def _corpus():
+    # 3 is duplicated, 99 and 98 are not in the corpus
+    tweets = [_tweet(1, 10), _tweet(2, 11), _tweet(3, 12), _tweet(4, 13), _tweet(3, 14), _tweet(5, 10)]
+    retweets = [_tweet(101, 20, [1]), _tweet(102, 21, [3]), _tweet(103, 22, [99]), _tweet(104, 23, [2, 3, 4]),
+            _tweet(105, 10, [5]), _tweet(106, 24, [98, 1]), _tweet(107, 25, [4])]
+    return tweets, retweets
+
+
+def _same_issues(a, b):
+    assert len(a) == len(b)
+    for (rt_a, orig_a), (rt_b, orig_b) in zip(a, b):
+        assert rt_a['tweet_id'] == rt_b['tweet_id']
+        pd.testing.assert_frame_equal(orig_a[['tweet_id', 'author_id']], orig_b[['tweet_id', 'author_id']])
+
+
+def test_index_and_table_joins_match_scan():
+    tweets, retweets = _corpus()
+    scan = rt_source_to_target(*format_tweets(tweets, retweets, v=False), method='scan')
+    index = rt_source_to_target(*format_tweets(tweets, retweets, v=False), method='index')
+    table = rt_source_to_target(*format_tweets(tweets, retweets, table=True, v=False), method='index')
+
+    assert [(c['source'], c['target']) for c in scan[0]] == [('10', '20'), ('11', '23'), ('13', '23'), ('10', '10'), ('10', '24'), ('13', '25')]
+    assert len(scan[1]) == 2 and scan[2] == 2
+    for result in (index, table):
+        assert [(str(c['source']), str(c['target'])) for c in result[0]] == [(c['source'], c['target']) for c in scan[0]]
+        _same_issues(result[1], scan[1])
+        assert result[2] == scan[2]
+
+
+def _baseline_links(connectionlist):
+    '''Edges and weights as the baseline write_edgelist counted them, with frozensets of the node pairs.'''
+    c = Counter(frozenset([s, t]) for s, t in zip(connectionlist['source'], connectionlist['target']))
+    return {pair: n for pair, n in c.items() if len(pair) == 2}
+
+
+def _links(edges):
+    return {frozenset([s, t]): w for s, t, w in zip(edges['source'], edges['target'], edges['weight'])}
+
+
+@pytest.mark.parametrize('labels', [['a', 'b', 'c', 'd'], [7, 3, 12, 5]])
+def test_write_edgelist_matches_tuple_counts(tmp_path, labels):
+    a, b, c, d = labels
+    # swapped duplicates, self-loops and a repeated self-loop
+    connectionlist = dict(source=[a, b, a, c, c, d, a, d, b], target=[b, a, b, c, c, a, c, b, d])
+    fp = tmp_path / 'edgelist.txt'
+    edges = write_edgelist(connectionlist, fp, v=False)
+
+    assert _links(edges) == _baseline_links(connectionlist)
+    assert (edges['source'] < edges['target']).all()
+    assert list(zip(edges['source'], edges['target'])) == sorted(zip(edges['source'], edges['target']))
+    lines = [l.split() for l in fp.read_text().splitlines()]
+    assert lines == [[str(s), str(t), str(w)] for s, t, w in zip(edges['source'], edges['target'], edges['weight'])]
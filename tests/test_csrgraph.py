@@ -0,0 +1,41 @@
+import networkx as nx
+import numpy as np
+from csrgraph import CSRGraph, weighted_clustering
+
+
+def _graph(seed=0):
+    '''Weighted random graph with several components.'''
+    rng = np.random.default_rng(seed)
+    g = nx.gnm_random_graph(120, 300, seed=seed)
+    g.add_edges_from([(200, 201), (201, 202), (202, 200), (203, 204)])
+    for s, t in g.edges():
+        g[s][t]['weight'] = int(rng.integers(1, 20))
+    return g
+
+
+def _expected(g, labels):
+    c = nx.clustering(g, weight='weight')
+    return np.array([c[n] for n in labels])
+
+
+def test_weighted_clustering_matches_networkx():
+    g = _graph()
+    csr = CSRGraph.from_networkx(g)
+    np.testing.assert_allclose(csr.clustering(), _expected(g, csr.labels), atol=1e-12)
+    # blocks of rows give the same coefficients, down to one row per block
+    for block_nnz in (1, 50):
+        np.testing.assert_allclose(weighted_clustering(csr.adjacency, block_nnz=block_nnz), csr.clustering(), atol=1e-15)
+
+
+def test_largest_component_clustering_rescale():
+    # vis.vis_net_stats rescales the coefficients of the full graph to the largest component
+    g = _graph(1)
+    # heaviest edge outside of the largest component, so the rescale matters
+    g[203][204]['weight'] = 100
+    csr = CSRGraph.from_networkx(g)
+    lcc = csr.largest_component_mask()
+    rescaled = csr.clustering()[lcc] * csr.adjacency.data.max() / csr.adjacency[lcc].max()
+
+    lccg = g.subgraph(max(nx.connected_components(g), key=len))
+    np.testing.assert_allclose(rescaled, _expected(lccg, csr.labels[lcc]), atol=1e-12)
+    np.testing.assert_allclose(csr.largest_component().clustering(), rescaled, atol=1e-12)
@@ -0,0 +1,31 @@
+import os
+import numpy as np
+from build_net import aggregate_edges
+from shards import EdgeShards
+
+
+def test_interned_shards_split_within_budget(tmp_path):
+    rng = np.random.default_rng(0)
+    shards = EdgeShards(tmp_path / 'shards', n_shards=64, memory_budget=50000)
+    sources, targets = [], []
+    for _ in range(8):
+        s, t = rng.integers(0, 10 ** 6, size=(2, 5000))
+        shards.add(s, t)
+        sources.append(s)
+        targets.append(t)
+    shards.flush()
+
+    workers = 2
+    limit = shards.memory_budget // workers
+    assert any(os.path.getsize(shards.shard_path(i)) * 3 > limit for i in range(shards.n_shards))
+    outfps = shards.reduce(workers=workers)
+    parts = [str(fp)[:-len('.edges')] for fp in outfps]
+    assert len(parts) > shards.n_shards
+    assert all(os.path.getsize(p) * 3 <= limit for p in parts)
+
+    # the split parts still hold every connection once
+    lo, hi, weight = aggregate_edges(np.concatenate(sources), np.concatenate(targets))
+    edges = np.concatenate([np.loadtxt(fp, dtype=np.int64, ndmin=2) for fp in outfps])
+    edges = edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+    loops = lo == hi
+    assert np.array_equal(edges, np.column_stack([lo[~loops], hi[~loops], weight[~loops]]))